@@ -2,56 +2,102 @@
 """
 Route module for the API.
 """
-
+import importlib
+import threading
 from os import getenv
+from api.v1 import (compression, json_provider, metrics, profiler,
+                    timing)
 from api.v1.views import app_views
-from flask import Flask, jsonify, abort, request
+from flask import Flask, jsonify, abort, current_app, request
 from flask_cors import CORS
 
+# Authentication classes by AUTH_TYPE, imported only once selected
+AUTH_CLASSES = {
+    'auth': ('api.v1.auth.auth', 'Auth'),
+    'basic_auth': ('api.v1.auth.basic_auth', 'BasicAuth'),
+}
 
-app = Flask(__name__)
-app.register_blueprint(app_views)
+AUTH_TYPE = getenv("AUTH_TYPE")
 
-# CORS config to allow requests
-# from any origin for the API routes
-CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+# Endpoints served before the models are loaded
+UNLOADED_ENDPOINTS = ('app_views.status', 'app_views.ready',
+                      'app_views.metrics')
+
+# Set once every model class is loaded from its file
+models_loaded = threading.Event()
+_load_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def load_models() -> None:
+    """
+    Loads every model class from its file, once.
+    """
+    if models_loaded.is_set():
+        return
+    with _load_lock:
+        if models_loaded.is_set():
+            return
+        from models.user import User
+        User.load_from_file()
+        models_loaded.set()
 
-# Initialize authentication based
-# on the AUTH_TYPE environment variable
-auth = None
-AUTH_TYPE = getenv("AUTH_TYPE")
 
-# Check the AUTH_TYPE and initialize the
-# corresponding authentication class
-if AUTH_TYPE == 'auth':
-    from api.v1.auth.auth import Auth
-    auth = Auth()
-elif AUTH_TYPE == 'basic_auth':
-    from api.v1.auth.basic_auth import BasicAuth
-    auth = BasicAuth()
+def warm_up() -> threading.Thread:
+    """
+    Loads the models in a background thread, unless already started.
+    """
+    global _warm_up_thread
+    with _load_lock:
+        if _warm_up_thread is None and not models_loaded.is_set():
+            _warm_up_thread = threading.Thread(
+                target=load_models, name='warm-up', daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def create_auth(auth_type: str = None):
+    """
+    Creates the authentication selected by AUTH_TYPE,
+    importing only its module.
+    """
+    if auth_type not in AUTH_CLASSES:
+        return None
+    module_name, class_name = AUTH_CLASSES[auth_type]
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def ensure_models_loaded():
+    """
+    Before request handler loading the models on the first request.
+    """
+    if request.endpoint not in UNLOADED_ENDPOINTS:
+        load_models()
 
 
-@app.before_request
 def before_request():
     """
     Before request handler to enforce authentication rules.
     """
+    auth = current_app.extensions['auth']
     if auth is None:
         return
 
     excluded_list = ['/api/v1/status/',
+                     '/api/v1/ready/',
                      '/api/v1/unauthorized/',
-                     '/api/v1/forbidden/'
+                     '/api/v1/forbidden/',
+                     '/api/v1/metrics/'
                      ]
 
     if auth.require_auth(request.path, excluded_list):
         if auth.authorization_header(request) is None:
             abort(401, description="Unauthorized")
-        if auth.current_user(request) is None:
+        request.current_user = auth.current_user(request)
+        if request.current_user is None:
             abort(403, description='Forbidden')
 
 
-@app.errorhandler(404)
 def not_found(error) -> str:
     """
     Not found handler.
@@ -61,7 +107,6 @@ def not_found(error) -> str:
     return jsonify({"error": "Not found"}), 404
 
 
-@app.errorhandler(401)
 def unauthorized(error) -> str:
     """
     Unauthorized handler
@@ -69,7 +114,6 @@ def unauthorized(error) -> str:
     return jsonify({"error": "Unauthorized"}), 401
 
 
-@app.errorhandler(403)
 def forbidden(error) -> str:
     """
     Forbidden handler
@@ -77,6 +121,66 @@ def forbidden(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+def create_app(auth_type: str = None, warm: bool = None) -> Flask:
+    """
+    Creates the API app. Models are loaded by the first request that
+    needs them, or in the background right away when `warm` is set.
+    Args:
+        auth_type (str): Defaults to the AUTH_TYPE environment variable.
+        warm (bool): Defaults to the WARM_UP environment variable.
+    Returns:
+        Flask: the app.
+    """
+    if auth_type is None:
+        auth_type = getenv("AUTH_TYPE")
+    if warm is None:
+        warm = getenv("WARM_UP", "").lower() in ("1", "true", "yes")
+
+    app = Flask(__name__)
+    # orjson when importable, for responses as for the file store
+    json_provider.init_app(app)
+    app.register_blueprint(app_views)
+
+    # CORS config to allow requests
+    # from any origin for the API routes
+    CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
+
+    auth = create_auth(auth_type)
+    app.extensions['auth'] = auth
+
+    app.before_request(ensure_models_loaded)
+    app.before_request(before_request)
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(401, unauthorized)
+    app.register_error_handler(403, forbidden)
+
+    # Gzip large responses, and streamed ones as they are sent
+    compression.init_app(app)
+
+    # Count requests, storage writes and password hashes
+    # for /api/v1/metrics
+    metrics.init_app(app)
+
+    # Time the auth pipeline of every request when SERVER_TIMING is set
+    if timing.init_app(app) and auth is not None:
+        timing.instrument(auth, 'require_auth')
+        timing.instrument(auth, 'current_user')
+
+    # Profile a sample of requests when PROFILE_RATE
+    # or PROFILE_SECRET is set
+    profiler.init_app(app)
+
+    if warm:
+        warm_up()
+    return app
+
+
+app = create_app()
+# Authentication of the default app; each app keeps its own in
+# app.extensions['auth']
+auth = app.extensions['auth']
+
+
 if __name__ == "__main__":
     host = getenv("API_HOST", "0.0.0.0")
     port = getenv("API_PORT", "5000")
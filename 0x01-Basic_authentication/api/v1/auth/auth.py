@@ -24,6 +24,10 @@ class Auth:
         if not excluded_paths:
             return True
 
+        # Excluded paths end with a slash: be slash tolerant
+        if not path.endswith('/'):
+            path += '/'
+
         if path in excluded_paths:
             return False
 
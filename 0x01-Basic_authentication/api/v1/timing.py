@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Module for timing the phases of each request.
+
+Set SERVER_TIMING=1 to time require_auth, current_user, the view,
+save_to_file and jsonify with perf_counter_ns. Each response then
+carries a Server-Timing header and every phase feeds a histogram.
+Phases nest: the view includes the storage writes and jsonify it
+does. When SERVER_TIMING is not set nothing is wrapped at all.
+"""
+
+import os
+from bisect import bisect_left
+from functools import wraps
+from threading import get_ident
+from time import perf_counter_ns
+from typing import Callable, Tuple
+from flask import Flask, g, has_app_context
+from models import base
+
+ENABLED = os.getenv('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """
+    Histogram of durations in seconds that is updated without locks:
+    each thread counts into its own shard, shards are summed on read.
+    Shards are keyed by thread ident, which live threads never share
+    and new threads reuse, so their number stays bounded.
+    """
+
+    def __init__(self, buckets: Tuple[float] = BUCKETS):
+        """Initializes an empty histogram."""
+        self.buckets = tuple(buckets)
+        self._shards = {}
+
+    def observe(self, value: float) -> None:
+        """Counts one duration of `value` seconds."""
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            # The last two slots hold the +Inf bucket and the sum
+            shard = self._shards.setdefault(
+                get_ident(), [0] * (len(self.buckets) + 2))
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self) -> dict:
+        """
+        Sums the shards.
+        Returns:
+            dict: the count of each bucket, +Inf last, the total
+            count and the sum of the durations.
+        """
+        totals = [0] * (len(self.buckets) + 2)
+        for shard in tuple(self._shards.values()):
+            for i, value in enumerate(shard):
+                totals[i] += value
+        counts = totals[:-1]
+        return {"buckets": self.buckets, "counts": counts,
+                "count": sum(counts), "sum": totals[-1]}
+
+
+# Phase name -> Histogram of its durations
+HISTOGRAMS = {}
+
+
+def histogram(name: str) -> Histogram:
+    """Returns the histogram of a phase, creating it if needed."""
+    result = HISTOGRAMS.get(name)
+    if result is None:
+        result = HISTOGRAMS.setdefault(name, Histogram())
+    return result
+
+
+def record(name: str, duration_ns: int) -> None:
+    """Adds a duration to a phase of the current request, if timed."""
+    if not has_app_context():
+        return
+    phases = g.get('server_timing')
+    if phases is not None:
+        phases[name] = phases.get(name, 0) + duration_ns
+
+
+def timed(name: str, fn: Callable) -> Callable:
+    """Wraps `fn` so that its calls are recorded as phase `name`."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record(name, perf_counter_ns() - start)
+    return wrapper
+
+
+def instrument(obj, method: str, name: str = None) -> None:
+    """Times every call of `obj.method` as phase `name`."""
+    setattr(obj, method, timed(name or method, getattr(obj, method)))
+
+
+def _record_flush(s_class: str, duration_ns: int) -> None:
+    """Records a save_to_file of the current request."""
+    record('save_to_file', duration_ns)
+
+
+def start_timing() -> None:
+    """Starts timing the current request."""
+    g.server_timing = {}
+    g.server_timing_start = perf_counter_ns()
+
+
+def finish_timing(response):
+    """Adds the Server-Timing header and feeds the histograms."""
+    phases = g.pop('server_timing', None)
+    if phases is None:
+        return response
+    phases['total'] = perf_counter_ns() - g.pop('server_timing_start')
+    for name, duration in phases.items():
+        histogram(name).observe(duration / 1e9)
+    response.headers['Server-Timing'] = ', '.join(
+        '{};dur={:.3f}'.format(name, duration / 1e6)
+        for name, duration in phases.items())
+    return response
+
+
+def init_app(app: Flask) -> bool:
+    """
+    Times the views, jsonify and storage writes of `app`, once its
+    routes are registered.
+    Returns:
+        bool: True if timing is enabled, False otherwise.
+    """
+    if not ENABLED:
+        return False
+    for endpoint, view in app.view_functions.items():
+        app.view_functions[endpoint] = timed('view', view)
+    app.json.response = timed('jsonify', app.json.response)
+    if _record_flush not in base.FLUSH_LISTENERS:
+        base.FLUSH_LISTENERS.append(_record_flush)
+    # Run before and after every other hook, so that they are timed
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timing)
+    app.after_request_funcs.setdefault(None, []).insert(0, finish_timing)
+    return True
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Module of admin views
+"""
+import os
+from api.v1 import memory
+from api.v1.views import app_views
+from flask import abort, current_app, jsonify, request
+
+
+def require_admin() -> None:
+    """ Aborts with 403 unless the current user's email is listed
+    in the ADMIN_EMAILS environment variable (comma separated)
+    """
+    admins = {email.strip().lower()
+              for email in os.getenv('ADMIN_EMAILS', '').split(',')
+              if email.strip()}
+    user = getattr(request, 'current_user', None)
+    if user is None or (user.email or '').lower() not in admins:
+        abort(403)
+
+
+@app_views.route('/admin/memory', methods=['GET'], strict_slashes=False)
+def memory_usage() -> str:
+    """ GET /api/v1/admin/memory
+    Query parameter:
+      - sample: objects measured per store (optional)
+    Return:
+      - approximate bytes of each model class and of the sessions,
+        and the state of tracemalloc
+      - 403 if the user is not an admin
+    """
+    require_admin()
+    auth = current_app.extensions['auth']
+    sample = request.args.get('sample', memory.SAMPLE_SIZE, type=int)
+    return jsonify(memory.report(auth, max(1, sample)))
+
+
+@app_views.route('/admin/memory/snapshots', methods=['POST'],
+                 strict_slashes=False)
+def memory_snapshot() -> str:
+    """ POST /api/v1/admin/memory/snapshots
+    Starts tracing allocations if needed and takes a snapshot
+    Return:
+      - the id of the snapshot
+      - 403 if the user is not an admin
+    """
+    require_admin()
+    return jsonify({"id": memory.take_snapshot()}), 201
+
+
+@app_views.route('/admin/memory/snapshots/<int:first>/diff/<int:second>',
+                 methods=['GET'], strict_slashes=False)
+def memory_diff(first: int, second: int) -> str:
+    """ GET /api/v1/admin/memory/snapshots/:first/diff/:second
+    Query parameter:
+      - limit: number of source lines returned (optional)
+    Return:
+      - the source lines whose allocations grew the most between
+        the two snapshots
+      - 404 if a snapshot doesn't exist
+      - 403 if the user is not an admin
+    """
+    require_admin()
+    limit = request.args.get('limit', 20, type=int)
+    try:
+        return jsonify(memory.diff(first, second, limit))
+    except KeyError:
+        abort(404)
+
+
+@app_views.route('/admin/memory/snapshots', methods=['DELETE'],
+                 strict_slashes=False)
+def memory_stop() -> str:
+    """ DELETE /api/v1/admin/memory/snapshots
+    Stops tracing allocations and forgets every snapshot
+    Return:
+      - empty JSON
+      - 403 if the user is not an admin
+    """
+    require_admin()
+    memory.stop()
+    return jsonify({}), 200
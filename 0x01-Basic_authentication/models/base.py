@@ -1,21 +1,149 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right
 from datetime import datetime
+from itertools import count, islice
 from typing import TypeVar, List, Iterable
 from os import path
-import json
+from time import monotonic, perf_counter_ns
+import threading
 import uuid
+from models import json_codec
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
 
+# Model classes by name, registered as they are defined
+MODELS = {}
+
+# Recent searches that matched nothing, per class: {key: expiry}.
+# Dropped for a class whenever one of its objects is saved or removed.
+MISSES = {}
+MISS_TTL = 5.0
+MISS_MAX_SIZE = 10000
+
+# Version of the objects of each class, changed whenever one of them
+# is saved or removed, or when they are loaded. Versions come from one
+# process-wide counter, so a version is never reused for another state.
+VERSIONS = {}
+_versions = count(1)
+# Tells this process's versions from those of a previous or other one
+EPOCH = uuid.uuid4().hex[:8]
+
+# Called with the class name and the duration in nanoseconds
+# of every save_to_file, e.g. to time storage writes
+FLUSH_LISTENERS = []
+
+# Indexes of the INDEXED attributes of each class: {attribute: Index}.
+# Built on first use, then kept up to date by save and remove.
+INDEXES = {}
+# Values of the INDEXED attributes of each object when last indexed
+INDEXED_VALUES = {}
+_index_lock = threading.RLock()
+
+
+class Index():
+    """ Ids of the objects of a class ordered by one attribute,
+    objects whose attribute is None being kept apart, last
+    """
+
+    def __init__(self, pairs: Iterable[tuple] = ()):
+        """ Initialize an index of (value, id) pairs
+        """
+        pairs = list(pairs)
+        ordered = sorted((self.key(value), obj_id)
+                         for value, obj_id in pairs if value is not None)
+        self.values = [value for value, obj_id in ordered]
+        self.ids = [obj_id for value, obj_id in ordered]
+        self.none_ids = {obj_id: None for value, obj_id in pairs
+                         if value is None}
+
+    @staticmethod
+    def key(value):
+        """ Comparable form of a value: strings and datetimes as is,
+        anything else as a string
+        """
+        if value is None or isinstance(value, (str, datetime)):
+            return value
+        return str(value)
+
+    def add(self, value, obj_id: str):
+        """ Index an object
+        """
+        if value is None:
+            self.none_ids[obj_id] = None
+            return
+        value = self.key(value)
+        position = bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.ids.insert(position, obj_id)
+
+    def discard(self, value, obj_id: str):
+        """ Unindex an object, if indexed
+        """
+        if value is None:
+            self.none_ids.pop(obj_id, None)
+            return
+        value = self.key(value)
+        for position in range(bisect_left(self.values, value),
+                              bisect_right(self.values, value)):
+            if self.ids[position] == obj_id:
+                del self.values[position]
+                del self.ids[position]
+                return
+
+    def equal(self, value) -> List[str]:
+        """ Ids of the objects whose attribute is `value`
+        """
+        if value is None:
+            return list(self.none_ids)
+        value = self.key(value)
+        return self.ids[bisect_left(self.values, value):
+                        bisect_right(self.values, value)]
+
+    def between(self, low=None, high=None) -> List[str]:
+        """ Ids of the objects whose attribute is at least `low` and
+        less than `high`, in order; a None bound is open
+        """
+        start = 0 if low is None else bisect_left(self.values,
+                                                  self.key(low))
+        end = len(self.values) if high is None else bisect_left(
+            self.values, self.key(high))
+        return self.ids[start:end]
+
+    def ordered(self, descending: bool = False,
+                limit: int = None) -> List[str]:
+        """ Ids of the first `limit` objects in order, or of all of
+        them, None values last
+        """
+        size = len(self.ids)
+        end = size if limit is None else min(limit, size)
+        if descending:
+            ids = self.ids[size - end:][::-1]
+        else:
+            ids = self.ids[:end]
+        if limit is None:
+            ids.extend(self.none_ids)
+        else:
+            ids.extend(islice(self.none_ids, limit - end))
+        return ids
+
 
 class Base():
     """ Base class
     """
 
+    # Attributes that query() filters and sorts on, through indexes
+    INDEXED = ()
+
+    def __init_subclass__(cls, **kwargs):
+        """ Register a model class
+        """
+        super().__init_subclass__(**kwargs)
+        MODELS[cls.__name__] = cls
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -24,14 +152,14 @@ class Base():
             DATA[s_class] = {}
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
+        # TIMESTAMP_FORMAT is ISO 8601, which fromisoformat parses
+        # many times faster than strptime
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = datetime.fromisoformat(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = datetime.fromisoformat(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -44,19 +172,45 @@ class Base():
             return False
         return (self.id == other.id)
 
-    def to_json(self, for_serialization: bool = False) -> dict:
-        """ Convert the object a JSON dictionary
+    def to_dict(self, for_serialization: bool = False,
+                fields: Iterable[str] = None) -> dict:
+        """ Convert the object a dictionary keeping datetimes, which
+        json_codec encodes natively, with only the attributes listed
+        in `fields` if given
         """
-        result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
-                continue
+        if fields is None:
+            items = self.__dict__.items()
+        else:
+            items = ((key, self.__dict__[key]) for key in fields
+                     if key in self.__dict__)
+        if for_serialization:
+            return dict(items)
+        return {key: value for key, value in items if key[0] != '_'}
+
+    def to_json(self, for_serialization: bool = False,
+                fields: Iterable[str] = None) -> dict:
+        """ Convert the object a JSON dictionary, with only the
+        attributes listed in `fields` if given
+        """
+        result = self.to_dict(for_serialization, fields)
+        for key, value in result.items():
             if type(value) is datetime:
                 result[key] = value.strftime(TIMESTAMP_FORMAT)
-            else:
-                result[key] = value
         return result
 
+    def etag(self) -> str:
+        """ Strong ETag of the object, from its id and updated_at
+        """
+        return "{}-{}".format(self.id, self.updated_at.strftime(
+            "%Y%m%d%H%M%S%f"))
+
+    @classmethod
+    def collection_etag(cls) -> str:
+        """ Strong ETag of all objects of the class, from its version
+        """
+        s_class = cls.__name__
+        return "{}-{}-{}".format(s_class, EPOCH, VERSIONS.get(s_class, 0))
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
@@ -64,11 +218,16 @@ class Base():
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         DATA[s_class] = {}
+        MISSES.pop(s_class, None)
+        VERSIONS[s_class] = next(_versions)
+        with _index_lock:
+            INDEXES.pop(s_class, None)
+            INDEXED_VALUES.pop(s_class, None)
         if not path.exists(file_path):
             return
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
+        with open(file_path, 'rb') as f:
+            objs_json = json_codec.loads(f.read())
             for obj_id, obj_json in objs_json.items():
                 DATA[s_class][obj_id] = cls(**obj_json)
 
@@ -76,30 +235,44 @@ class Base():
     def save_to_file(cls):
         """ Save all objects to file
         """
+        start = perf_counter_ns()
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         objs_json = {}
         for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+            objs_json[obj_id] = obj.to_dict(True)
+
+        with open(file_path, 'wb') as f:
+            f.write(json_codec.dumps(objs_json))
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        duration = perf_counter_ns() - start
+        for listener in FLUSH_LISTENERS:
+            listener(s_class, duration)
 
-    def save(self):
-        """ Save current object
+    def save(self, flush: bool = True):
+        """ Save current object, writing the file unless `flush` is
+        False: batches then call save_to_file once
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
         DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        MISSES.pop(s_class, None)
+        VERSIONS[s_class] = next(_versions)
+        self._reindex(True)
+        if flush:
+            self.__class__.save_to_file()
 
-    def remove(self):
-        """ Remove object
+    def remove(self, flush: bool = True):
+        """ Remove object, writing the file unless `flush` is False
         """
         s_class = self.__class__.__name__
         if DATA[s_class].get(self.id) is not None:
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            MISSES.pop(s_class, None)
+            VERSIONS[s_class] = next(_versions)
+            self._reindex(False)
+            if flush:
+                self.__class__.save_to_file()
 
     @classmethod
     def count(cls) -> int:
@@ -133,5 +306,137 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        if len(attributes) == 0:
+            return list(filter(_search, DATA[s_class].values()))
+
+        # Known misses are answered without scanning
+        try:
+            key = tuple(sorted(attributes.items()))
+            hash(key)
+        except TypeError:
+            key = None
+        misses = MISSES.setdefault(s_class, {})
+        now = monotonic()
+        if key is not None and misses.get(key, 0) > now:
+            return []
+
+        result = list(filter(_search, DATA[s_class].values()))
+        if not result and key is not None:
+            misses.pop(key, None)
+            if len(misses) >= MISS_MAX_SIZE:
+                del misses[next(iter(misses))]
+            misses[key] = now + MISS_TTL
+        return result
+
+    def _reindex(self, stored: bool):
+        """ Update the built indexes of the class for the object, now
+        `stored` or removed
+        """
+        s_class = self.__class__.__name__
+        if not self.INDEXED or s_class not in INDEXES:
+            return
+        with _index_lock:
+            indexes = INDEXES[s_class]
+            indexed = INDEXED_VALUES[s_class]
+            old = indexed.pop(self.id, None)
+            new = None
+            if stored:
+                new = tuple(getattr(self, attribute, None)
+                            for attribute in self.INDEXED)
+                indexed[self.id] = new
+            for i, attribute in enumerate(self.INDEXED):
+                if old is not None and (new is None or old[i] != new[i]):
+                    indexes[attribute].discard(old[i], self.id)
+                if new is not None and (old is None or old[i] != new[i]):
+                    indexes[attribute].add(new[i], self.id)
+
+    @classmethod
+    def indexes(cls) -> dict:
+        """ Indexes of the INDEXED attributes, built on first use
+        """
+        s_class = cls.__name__
+        with _index_lock:
+            indexes = INDEXES.get(s_class)
+            if indexes is None:
+                indexed = {obj_id: tuple(getattr(obj, attribute, None)
+                                         for attribute in cls.INDEXED)
+                           for obj_id, obj in DATA[s_class].items()}
+                indexes = {attribute: Index((values[i], obj_id)
+                                            for obj_id, values
+                                            in indexed.items())
+                           for i, attribute in enumerate(cls.INDEXED)}
+                INDEXED_VALUES[s_class] = indexed
+                INDEXES[s_class] = indexes
+            return indexes
+
+    @classmethod
+    def query(cls, equal: dict = None, ranges: dict = None,
+              sort: str = None, descending: bool = False,
+              limit: int = None) -> List[TypeVar('Base')]:
+        """ Objects whose attributes equal those of `equal` and are
+        within the (low, high) bounds of `ranges`, sorted by the
+        attribute `sort`, at most `limit` of them, through indexes
+        Raises ValueError for an attribute that is not indexed
+        """
+        s_class = cls.__name__
+        equal = equal or {}
+        ranges = ranges or {}
+        for attribute in list(equal) + list(ranges) + [sort]:
+            if attribute is not None and attribute not in cls.INDEXED:
+                raise ValueError("No index on {}".format(attribute))
+
+        with _index_lock:
+            indexes = cls.indexes()
+            # The smallest set of candidates is checked against the rest
+            candidates = [(indexes[attribute].equal(value), 'equal',
+                           attribute) for attribute, value in equal.items()]
+            candidates.extend((indexes[attribute].between(*bounds), 'range',
+                               attribute)
+                              for attribute, bounds in ranges.items())
+            used = None
+            if candidates:
+                ids, kind, attribute = min(candidates,
+                                           key=lambda c: len(c[0]))
+                used = (kind, attribute)
+                if sort == attribute and descending:
+                    ids.reverse()
+            elif sort is not None:
+                ids = indexes[sort].ordered(descending, limit)
+            else:
+                ids = list(DATA[s_class])
+        # Candidates already in the requested order may stop at the limit
+        ordered = sort is None or used is None or used[1] == sort
+
+        def matches(obj):
+            for attribute, value in equal.items():
+                if ('equal', attribute) != used and Index.key(
+                        getattr(obj, attribute, None)) != Index.key(value):
+                    return False
+            for attribute, (low, high) in ranges.items():
+                value = Index.key(getattr(obj, attribute, None))
+                if ('range', attribute) != used and (
+                        value is None or
+                        (low is not None and value < Index.key(low)) or
+                        (high is not None and value >= Index.key(high))):
+                    return False
+            return True
+
+        objects = DATA[s_class]
+        result = []
+        for obj_id in ids:
+            obj = objects.get(obj_id)
+            if obj is not None and matches(obj):
+                result.append(obj)
+                if ordered and limit is not None and len(result) >= limit:
+                    break
+        if not ordered:
+            present = [obj for obj in result
+                       if getattr(obj, sort, None) is not None]
+            present.sort(key=lambda obj: Index.key(getattr(obj, sort)),
+                         reverse=descending)
+            result = present + [obj for obj in result
+                                if getattr(obj, sort, None) is None]
+        if limit is not None:
+            result = result[:limit]
+        return result
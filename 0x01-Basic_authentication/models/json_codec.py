@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+""" JSON encoding shared by the file store and the API responses
+
+orjson is used when it is importable, the standard library otherwise;
+JSON_BACKEND=json forces the standard library. Both encode datetimes
+natively as TIMESTAMP_FORMAT and dates as %Y-%m-%d, write compact
+UTF-8 and return bytes.
+"""
+import json
+from datetime import date, datetime
+from os import getenv
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None and getenv('JSON_BACKEND', 'orjson') != 'json':
+    BACKEND = 'orjson'
+else:
+    BACKEND = 'json'
+
+if orjson is not None:
+    # Naive datetimes without microseconds are TIMESTAMP_FORMAT
+    _OPTIONS = orjson.OPT_OMIT_MICROSECONDS | orjson.OPT_NON_STR_KEYS
+    _SORTED_OPTIONS = _OPTIONS | orjson.OPT_SORT_KEYS
+    _INDENTED_OPTIONS = _SORTED_OPTIONS | orjson.OPT_INDENT_2
+
+
+def _default(value):
+    """ Encoding of the values the standard library can't encode
+    """
+    if isinstance(value, datetime):
+        # Same as strftime(TIMESTAMP_FORMAT), and faster
+        return value.isoformat(timespec='seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(value).__name__))
+
+
+def dumps(obj, sort_keys: bool = False, indent: bool = False) -> bytes:
+    """ Encode `obj` as UTF-8 JSON, compact unless `indent` is set
+    """
+    if BACKEND == 'orjson':
+        if indent:
+            return orjson.dumps(obj, default=_default,
+                                option=_INDENTED_OPTIONS)
+        return orjson.dumps(obj, default=_default, option=(
+            _SORTED_OPTIONS if sort_keys else _OPTIONS))
+    return json.dumps(obj, default=_default, ensure_ascii=False,
+                      sort_keys=sort_keys or indent,
+                      indent=2 if indent else None,
+                      separators=None if indent else (',', ':')
+                      ).encode('utf-8')
+
+
+def loads(data):
+    """ Decode JSON from bytes or str
+    """
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
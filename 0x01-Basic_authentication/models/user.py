@@ -2,13 +2,30 @@
 """ User module
 """
 import hashlib
+from time import perf_counter_ns
 from models.base import Base
 
+# Called with the duration in nanoseconds of every password hash
+HASH_LISTENERS = []
+
+
+def _hash_password(pwd: str) -> str:
+    """ SHA256 hex digest of a password
+    """
+    start = perf_counter_ns()
+    hashed = hashlib.sha256(pwd.encode()).hexdigest().lower()
+    duration = perf_counter_ns() - start
+    for listener in HASH_LISTENERS:
+        listener(duration)
+    return hashed
+
 
 class User(Base):
     """ User class
     """
 
+    INDEXED = ('email', 'first_name', 'last_name', 'created_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -31,7 +48,7 @@ class User(Base):
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            self._password = _hash_password(pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
         """ Validate a password
@@ -40,8 +57,7 @@ class User(Base):
             return False
         if self.password is None:
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        return _hash_password(pwd) == self.password
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
@@ -16,9 +16,25 @@ class Auth:
     def require_auth(self, path: str, excluded_paths: List[str]) -> bool:
         """
         finds if a given path requires authentication.
+        Paths are slash tolerant and excluded paths ending
+        with '*' match any path starting with their prefix.
         Returns:
             bool: True if authentication is required, False otherwise.
         """
+        if path is None or not excluded_paths:
+            return True
+
+        # Excluded paths end with a slash: be slash tolerant
+        if not path.endswith('/'):
+            path += '/'
+
+        for excluded_path in excluded_paths:
+            if excluded_path.endswith('*'):
+                if path.startswith(excluded_path[:-1]):
+                    return False
+            elif path == excluded_path:
+                return False
+
         return True
 
     def authorization_header(self, request=None) -> str:
@@ -57,6 +57,10 @@ class BasicAuth(Auth):
         if ':' not in decoded_base64_authorization_header:
             return (None, None)
 
+        # The password may itself contain colons
+        email, password = decoded_base64_authorization_header.split(':', 1)
+        return (email, password)
+
     def user_object_from_credentials(
             self, user_email: str, user_pwd: str) -> TypeVar('User'):
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Module for throttling login attempts with token buckets.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TokenBucket:
+    """
+    A bucket holding up to `capacity` tokens, refilled at `rate`
+    tokens per second.
+    """
+
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, capacity: float, now: float):
+        """Initializes a full bucket."""
+        self.tokens = capacity
+        self.updated_at = now
+
+    def consume(self, capacity: float, rate: float, now: float) -> bool:
+        """
+        Refills the bucket for the elapsed time and takes one token.
+        Returns:
+            bool: True if a token was available, False otherwise.
+        """
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(capacity, self.tokens + elapsed * rate)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter keyed by an arbitrary string.
+
+    Buckets live in a bounded LRU: once `max_keys` buckets exist, the
+    least recently used one is dropped, so memory stays constant no
+    matter how many distinct keys are seen.
+    """
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 10000):
+        """Initializes the limiter."""
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self.rejected = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        """
+        Takes a token from the bucket of `key`.
+        Returns:
+            bool: True if the call is allowed, False if it is throttled.
+        """
+        now = monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.capacity, now)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            if bucket.consume(self.capacity, self.rate, now):
+                return True
+            self.rejected += 1
+            return False
+
+    def __len__(self) -> int:
+        """Number of buckets currently tracked."""
+        return len(self._buckets)
+
+
+def _env_float(name: str, default: float) -> float:
+    """Reads a float from the environment, falling back to `default`."""
+    try:
+        return float(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+class LoginThrottle:
+    """
+    Throttles login attempts per client IP and per email.
+
+    Configured through the environment:
+        LOGIN_IP_BURST, LOGIN_IP_RATE: bucket size and refill
+        (tokens per second) for each client IP.
+        LOGIN_EMAIL_BURST, LOGIN_EMAIL_RATE: same for each email.
+        LOGIN_THROTTLE_SIZE: maximum number of buckets per limiter.
+    """
+
+    def __init__(self):
+        """Initializes the IP and email limiters from the environment."""
+        max_keys = int(_env_float('LOGIN_THROTTLE_SIZE', 10000))
+        self.by_ip = RateLimiter(_env_float('LOGIN_IP_BURST', 20),
+                                 _env_float('LOGIN_IP_RATE', 1),
+                                 max_keys)
+        self.by_email = RateLimiter(_env_float('LOGIN_EMAIL_BURST', 5),
+                                    _env_float('LOGIN_EMAIL_RATE', 0.2),
+                                    max_keys)
+
+    def allow(self, ip: str, email: str) -> bool:
+        """
+        Checks a login attempt against both limiters.
+        Must be called before any password is hashed.
+        Returns:
+            bool: True if the attempt may proceed.
+        """
+        if not self.by_ip.allow(ip or ''):
+            return False
+        return self.by_email.allow((email or '').strip().lower())
+
+    @property
+    def rejections(self) -> dict:
+        """Number of rejected attempts per limiter."""
+        return {'ip': self.by_ip.rejected,
+                'email': self.by_email.rejected}
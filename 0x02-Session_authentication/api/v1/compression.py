@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Module for compressing responses with gzip.
+
+JSON and text responses are compressed when the client accepts gzip:
+buffered ones from COMPRESS_MIN_SIZE bytes, streamed ones always and
+chunk by chunk as they are sent, so they are never buffered whole.
+COMPRESS_LEVEL sets the zlib level, from 1 (fastest) to 9 (smallest);
+0 disables compression.
+"""
+
+import os
+import zlib
+from typing import Iterable, Iterator
+from flask import Flask, request
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 1024
+
+# zlib window bits asking for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _env_int(name: str, default: int) -> int:
+    """Reads an integer from the environment, or returns `default`."""
+    try:
+        return int(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+def gzip_bytes(data: bytes, level: int = DEFAULT_LEVEL) -> bytes:
+    """Compresses `data` into a gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_stream(chunks: Iterable, level: int = DEFAULT_LEVEL
+                ) -> Iterator[bytes]:
+    """Compresses an iterable of chunks as they come."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class Compressor:
+    """
+    After request handler compressing eligible responses.
+    """
+
+    def __init__(self, level: int = DEFAULT_LEVEL,
+                 min_size: int = DEFAULT_MIN_SIZE):
+        """Initializes the compressor; a level of 0 disables it."""
+        self.level = level
+        self.min_size = min_size
+
+    def compressible(self, response) -> bool:
+        """Whether a response may be compressed at all."""
+        mimetype = response.mimetype or ''
+        return (self.level > 0 and 200 <= response.status_code != 204 and
+                response.status_code != 304 and
+                not response.direct_passthrough and
+                'Content-Encoding' not in response.headers and
+                (mimetype == 'application/json' or
+                 mimetype.startswith('text/')))
+
+    def __call__(self, response):
+        """Compresses the response if the client accepts gzip."""
+        if not self.compressible(response):
+            return response
+        if not response.is_streamed and \
+                response.calculate_content_length() < self.min_size:
+            return response
+        # Caches must not serve one encoding to clients of another
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings.quality('gzip') <= 0:
+            return response
+
+        if response.is_streamed:
+            response.response = gzip_stream(response.response, self.level)
+            response.headers.pop('Content-Length', None)
+        else:
+            response.set_data(gzip_bytes(response.get_data(), self.level))
+        response.headers['Content-Encoding'] = 'gzip'
+        # The compressed body is another representation: weaken the ETag
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def init_app(app: Flask) -> Compressor:
+    """
+    Compresses the responses of `app` as configured by COMPRESS_LEVEL
+    and COMPRESS_MIN_SIZE.
+    Returns:
+        Compressor: the compressor, also in app.extensions.
+    """
+    compressor = Compressor(_env_int('COMPRESS_LEVEL', DEFAULT_LEVEL),
+                            _env_int('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE))
+    app.extensions['compression'] = compressor
+    app.after_request(compressor)
+    return compressor
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Module for encoding the API's JSON with models.json_codec: orjson
+when it is importable, the standard library otherwise.
+
+Responses keep the output of Flask's default provider: sorted keys,
+compact unless in debug mode, a trailing newline, and datetimes as
+TIMESTAMP_FORMAT, like Base.to_json.
+"""
+
+from flask import Flask
+from flask.json.provider import JSONProvider
+from models import json_codec
+
+
+class CodecJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by models.json_codec.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Encodes `obj` with sorted keys, indented if `indent` is set."""
+        return json_codec.dumps(obj, sort_keys=True,
+                                indent=bool(kwargs.get('indent'))
+                                ).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Decodes JSON from bytes or str."""
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Response of the JSON of the arguments, as jsonify's."""
+        obj = self._prepare_response_obj(args, kwargs)
+        body = json_codec.dumps(obj, sort_keys=True, indent=self._app.debug)
+        return self._app.response_class(body + b'\n',
+                                        mimetype='application/json')
+
+
+def init_app(app: Flask) -> None:
+    """Encodes and decodes the JSON of `app` with models.json_codec."""
+    app.json = CodecJSONProvider(app)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Module for accounting memory: approximate bytes held by each model
+class and by the session store, and tracemalloc snapshots to diff.
+
+Usage:
+    python3 -m api.v1.memory             # stores of the current directory
+    python3 -m api.v1.memory --trace     # and what loading them allocates
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Dict, List
+from models import base
+
+# Objects measured per store; the size of the others is extrapolated
+SAMPLE_SIZE = 1000
+
+# Snapshots kept for diffing, the oldest being dropped first
+MAX_SNAPSHOTS = 10
+
+# Shared by every instance, so never counted
+_SKIPPED = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def deep_size(obj, seen: set = None) -> int:
+    """
+    Approximates the bytes held by `obj` and the objects it refers to,
+    counting each object once across calls sharing `seen`.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIPPED):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            for key, value in item.items():
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+    return total
+
+
+def store_usage(store: dict, sample_size: int = SAMPLE_SIZE) -> dict:
+    """
+    Approximates the bytes held by a dict of objects, measuring at most
+    `sample_size` entries.
+    Returns:
+        dict: the number of objects and the approximate bytes.
+    """
+    items = list(store.items())
+    total = sys.getsizeof(store)
+    if items:
+        sample = items
+        if len(items) > sample_size:
+            sample = random.sample(items, sample_size)
+        seen = set()
+        sampled = sum(deep_size(key, seen) + deep_size(value, seen)
+                      for key, value in sample)
+        total += sampled * len(items) // len(sample)
+    return {"objects": len(items), "bytes": total}
+
+
+def model_usage(sample_size: int = SAMPLE_SIZE) -> Dict[str, dict]:
+    """Approximate usage of each model class loaded."""
+    return {s_class: store_usage(objects, sample_size)
+            for s_class, objects in sorted(tuple(base.DATA.items()))}
+
+
+def report(auth=None, sample_size: int = SAMPLE_SIZE) -> dict:
+    """
+    Accounts the memory of the models and of the session store.
+    Returns:
+        dict: usage of each model class, of the sessions held by
+        `auth` if any, and the state of tracemalloc.
+    """
+    result = {"models": model_usage(sample_size)}
+    sessions = getattr(auth, 'user_id_by_session_id', None)
+    if sessions is not None:
+        result["sessions"] = store_usage(sessions, sample_size)
+    result["tracemalloc"] = status()
+    return result
+
+
+_snapshots = OrderedDict()
+_last_id = 0
+_lock = threading.Lock()
+
+
+def take_snapshot(frames: int = 1) -> int:
+    """
+    Takes a tracemalloc snapshot, starting to trace if needed:
+    only allocations made since tracing started are seen.
+    Returns:
+        int: the id of the snapshot.
+    """
+    global _last_id
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),))
+    with _lock:
+        _last_id += 1
+        _snapshots[_last_id] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+        return _last_id
+
+
+def diff(first: int, second: int, limit: int = 20) -> List[dict]:
+    """
+    Compares two snapshots by source line.
+    Returns:
+        List[dict]: the `limit` lines whose allocations grew the most.
+    Raises:
+        KeyError: If a snapshot is unknown.
+    """
+    stats = _snapshots[second].compare_to(_snapshots[first], 'lineno')
+    return [{"location": str(stat.traceback),
+             "size_diff": stat.size_diff, "size": stat.size,
+             "count_diff": stat.count_diff, "count": stat.count}
+            for stat in stats[:limit]]
+
+
+def stop() -> None:
+    """Stops tracing and forgets every snapshot."""
+    with _lock:
+        _snapshots.clear()
+    tracemalloc.stop()
+
+
+def status() -> dict:
+    """Whether tracemalloc traces, what it traced and the snapshots."""
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": tracemalloc.is_tracing(), "traced_bytes": current,
+            "peak_traced_bytes": peak, "snapshots": list(_snapshots)}
+
+
+def main() -> None:
+    """Reports the memory used by the stores of the current directory."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sample", type=int, default=SAMPLE_SIZE,
+                        help="objects measured per store")
+    parser.add_argument("--trace", action="store_true",
+                        help="diff tracemalloc snapshots around loading")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    from api.v1.app import load_models
+    if args.trace:
+        before = take_snapshot()
+    load_models()
+    result = {"models": model_usage(args.sample)}
+    if args.trace:
+        result["load_diff"] = diff(before, take_snapshot(), args.limit)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Module for profiling a sample of requests with cProfile.
+
+Disabled unless one of these is set:
+    PROFILE_RATE: fraction of requests to profile, e.g. 0.01.
+    PROFILE_SECRET: profile requests carrying a valid X-Profile-Token
+    header, made with `python3 -m <this module> METHOD PATH`.
+Other settings:
+    PROFILE_DIR: where stats are written, "profiles" by default.
+    PROFILE_KEEP: number of stats files kept, oldest removed first.
+    PROFILE_FLUSH: profiled requests aggregated into each file.
+
+Each file is a pstats dump, to be read with `python3 -m pstats`, next
+to a JSON summary measuring what profiling cost: the time spent in
+this module and how much slower profiled requests were.
+"""
+
+import atexit
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from time import perf_counter_ns
+from flask import Flask, g, request
+
+HEADER = 'X-Profile-Token'
+
+# Seconds during which a signed token is accepted
+TOKEN_LIFETIME = 300
+
+
+def _env_number(name: str, default, kind=float):
+    """Reads a number from the environment, or returns `default`."""
+    try:
+        return kind(os.getenv(name, default))
+    except (ValueError, TypeError):
+        return default
+
+
+def sign(secret: str, method: str, path: str, timestamp: int = None) -> str:
+    """
+    Makes a token allowing one METHOD PATH to be profiled.
+    Returns:
+        str: the value of the X-Profile-Token header.
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+    message = '{}:{} {}'.format(timestamp, method, path).encode()
+    digest = hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+    return '{}:{}'.format(timestamp, digest)
+
+
+class Profiler:
+    """
+    Profiles sampled requests and aggregates their stats, flushed
+    every `flush_every` profiled requests to a rotating directory.
+    """
+
+    def __init__(self, rate: float = 0.0, secret: str = None,
+                 directory: str = 'profiles', keep: int = 10,
+                 flush_every: int = 100):
+        """Initializes a profiler, disabled if nothing is sampled."""
+        self.rate = rate
+        self.secret = secret or None
+        self.directory = directory
+        self.keep = keep
+        self.flush_every = flush_every
+        self._stats = None
+        self._files = 0
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any request may be profiled."""
+        return self.rate > 0 or self.secret is not None
+
+    def _reset_counters(self) -> None:
+        """Starts a new aggregation period."""
+        self.requests = 0
+        self.profiled = 0
+        self.skipped = 0
+        self.overhead_ns = 0
+        self.profiled_ns = 0
+        self.unprofiled_ns = 0
+
+    def wants(self, method: str, path: str, token: str = None) -> bool:
+        """Whether a request is sampled or carries a valid token."""
+        if self.rate > 0 and random.random() < self.rate:
+            return True
+        if self.secret is None or not token:
+            return False
+        timestamp, _, _ = token.partition(':')
+        try:
+            if abs(time.time() - int(timestamp)) > TOKEN_LIFETIME:
+                return False
+        except ValueError:
+            return False
+        expected = sign(self.secret, method, path, int(timestamp))
+        return hmac.compare_digest(expected, token)
+
+    def start_request(self) -> None:
+        """Starts profiling the current request if it is sampled."""
+        start = perf_counter_ns()
+        g.profile_start = start
+        if not self.wants(request.method, request.path,
+                          request.headers.get(HEADER)):
+            self.overhead_ns += perf_counter_ns() - start
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, e.g. in a concurrent request
+            self.skipped += 1
+        else:
+            g.profile = profile
+        self.overhead_ns += perf_counter_ns() - start
+
+    def finish_request(self, exception=None) -> None:
+        """Stops profiling the current request and aggregates it."""
+        end = perf_counter_ns()
+        start = g.pop('profile_start', None)
+        if start is None:
+            return
+        profile = g.pop('profile', None)
+        self.requests += 1
+        if profile is None:
+            self.unprofiled_ns += end - start
+            return
+        profile.disable()
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            # Nothing was recorded
+            return
+        with self._lock:
+            self.profiled += 1
+            self.profiled_ns += end - start
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+            if self.profiled >= self.flush_every:
+                self._flush()
+            self.overhead_ns += perf_counter_ns() - end
+
+    def flush(self) -> None:
+        """Writes the stats aggregated so far, if any."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Writes the stats and their summary, then rotates the files."""
+        if self._stats is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._files += 1
+        name = os.path.join(self.directory, 'profile-{}-{}-{:06d}'.format(
+            time.strftime('%Y%m%dT%H%M%S'), os.getpid(), self._files))
+        self._stats.dump_stats(name + '.pstats')
+        with open(name + '.json', 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        self._stats = None
+        self._reset_counters()
+
+        stats_files = sorted(
+            file_name for file_name in os.listdir(self.directory)
+            if file_name.startswith('profile-') and
+            file_name.endswith('.pstats'))
+        for file_name in stats_files[:max(0, len(stats_files) - self.keep)]:
+            for suffix in ('.pstats', '.json'):
+                file_path = os.path.join(self.directory,
+                                         file_name[:-7] + suffix)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def summary(self) -> dict:
+        """
+        Measures the cost of profiling in the current period.
+        Returns:
+            dict: request counts, milliseconds spent in this module,
+            and the mean duration of profiled and other requests.
+        """
+        unprofiled = self.requests - self.profiled
+        return {
+            'requests': self.requests,
+            'profiled': self.profiled,
+            'skipped': self.skipped,
+            'overhead_ms': self.overhead_ns / 1e6,
+            'profiled_mean_ms': (self.profiled_ns / self.profiled / 1e6
+                                 if self.profiled else None),
+            'unprofiled_mean_ms': (self.unprofiled_ns / unprofiled / 1e6
+                                   if unprofiled else None),
+        }
+
+
+def from_env() -> Profiler:
+    """Creates a profiler configured by the environment."""
+    return Profiler(rate=_env_number('PROFILE_RATE', 0.0),
+                    secret=os.getenv('PROFILE_SECRET'),
+                    directory=os.getenv('PROFILE_DIR', 'profiles'),
+                    keep=_env_number('PROFILE_KEEP', 10, int),
+                    flush_every=_env_number('PROFILE_FLUSH', 100, int))
+
+
+def init_app(app: Flask, profiler: Profiler = None) -> Profiler:
+    """
+    Profiles sampled requests of `app`, hooks included.
+    Returns:
+        Profiler: the profiler, or None if it is disabled.
+    """
+    if profiler is None:
+        profiler = from_env()
+    if not profiler.enabled:
+        return None
+    # Run before and after every other hook, so that they are profiled
+    app.before_request_funcs.setdefault(None, []).insert(
+        0, profiler.start_request)
+    app.teardown_request_funcs.setdefault(None, []).insert(
+        0, profiler.finish_request)
+    atexit.register(profiler.flush)
+    return profiler
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or not os.getenv('PROFILE_SECRET'):
+        sys.exit('usage: PROFILE_SECRET=... {} METHOD PATH'.format(
+            sys.argv[0]))
+    print('{}: {}'.format(HEADER, sign(os.getenv('PROFILE_SECRET'),
+                                       sys.argv[1].upper(), sys.argv[2])))
@@ -7,6 +7,5 @@ app_views = Blueprint("app_views", __name__, url_prefix="/api/v1")
 
 from api.v1.views.index import *
 from api.v1.views.users import *
+from api.v1.views.admin import *
 from api.v1.views.session_auth import *
-
-User.load_from_file()
@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
 """ Module of Index views
 """
-from flask import Blueprint, jsonify, abort
+import re
+from time import monotonic
+from flask import Blueprint, Response, abort, current_app, jsonify
+from api.v1.metrics import CONTENT_TYPE, render
 from api.v1.views import app_views
+from models import base
+
+# Seconds /api/v1/stats is cached for, by the API and by clients
+STATS_MAX_AGE = 5
+
+# Body of the cached /api/v1/stats and when it expires
+_stats_cache = {"expires": 0.0, "body": None}
 
 
 @app_views.route('/status', methods=['GET'], strict_slashes=False)
@@ -14,16 +24,61 @@ def status() -> str:
     return jsonify({"status": "OK"})
 
 
+@app_views.route('/ready', methods=['GET'], strict_slashes=False)
+def ready() -> str:
+    """ GET /api/v1/ready
+    Return:
+      - 200 once the models are loaded
+      - 503 while they are loading, loading them in the background
+    """
+    from api.v1.app import models_loaded, warm_up
+    if models_loaded.is_set():
+        return jsonify({"status": "ready"})
+    warm_up()
+    return jsonify({"status": "loading"}), 503
+
+
+def stats_key(s_class: str) -> str:
+    """ Key of a model class in /api/v1/stats: UserSession gives
+    user_sessions
+    """
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', s_class).lower() + 's'
+
+
 @app_views.route('/stats/', strict_slashes=False)
 def stats() -> str:
     """ GET /api/v1/stats
     Return:
-      - the number of each objects
+      - the number of objects of each model class, and the number of
+        sessions held by the session authentication if any, cached
+        for STATS_MAX_AGE seconds
+    """
+    now = monotonic()
+    body = _stats_cache["body"]
+    if body is None or _stats_cache["expires"] <= now:
+        stats = {stats_key(s_class): len(base.DATA.get(s_class, ()))
+                 for s_class in sorted(tuple(base.MODELS))}
+        sessions = getattr(current_app.extensions.get('auth'),
+                           'user_id_by_session_id', None)
+        if sessions is not None:
+            stats['sessions'] = len(sessions)
+        body = current_app.json.dumps(stats) + "\n"
+        _stats_cache["body"] = body
+        _stats_cache["expires"] = now + STATS_MAX_AGE
+    response = Response(body, mimetype='application/json')
+    response.cache_control.private = True
+    response.cache_control.max_age = STATS_MAX_AGE
+    return response
+
+
+@app_views.route('/metrics', methods=['GET'], strict_slashes=False)
+def metrics() -> str:
+    """ GET /api/v1/metrics
+    Return:
+      - the metrics of the API in the Prometheus text format
     """
-    from models.user import User
-    stats = {}
-    stats['users'] = User.count()
-    return jsonify(stats)
+    auth = current_app.extensions['auth']
+    return Response(render(auth), content_type=CONTENT_TYPE)
 
 
 @app_views.route('/unauthorized', methods=['GET'], strict_slashes=False)
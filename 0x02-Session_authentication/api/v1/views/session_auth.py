@@ -5,8 +5,11 @@ Module for user login and session management views.
 
 import os
 from api.v1.views import app_views
+from api.v1.auth.rate_limit import LoginThrottle
 from models.user import User
-from flask import jsonify, request, abort
+from flask import current_app, jsonify, request, abort
+
+login_throttle = LoginThrottle()
 
 
 @app_views.route('/auth_session/login', methods=['POST'], strict_slashes=False)
@@ -19,6 +22,7 @@ def session_auth():
     - 400: If email or password is missing.
     - 404: If no user is found for the provided email.
     - 401: If the password is incorrect.
+    - 429: If too many attempts came from this IP or for this email.
     """
     email = request.form.get('email')
     password = request.form.get('password')
@@ -29,6 +33,10 @@ def session_auth():
     if not password:
         return jsonify({"error": "password missing"}), 400
 
+    # Throttle before any password gets hashed
+    if not login_throttle.allow(request.remote_addr, email):
+        return jsonify({"error": "too many requests"}), 429
+
     # Search for the user by email
     users = User.search({"email": email})
     if not users:
@@ -38,11 +46,11 @@ def session_auth():
     for user in users:
         if user.is_valid_password(password):
             # Import the authentication system and create a session
-            from api.v1.app import auth
+            auth = current_app.extensions['auth']
             session_id = auth.create_session(user.id)
 
             # Generate response and set session cookie
-            resp = jsonify(user.to_json())
+            resp = jsonify(user.to_dict())
             session_name = os.getenv('SESSION_NAME', 'session_id')
             resp.set_cookie(session_name, session_id)
 
@@ -62,7 +70,7 @@ def logout():
     - 404: If the session cookie is not found or
     the session cannot be destroyed.
     """
-    from api.v1.app import auth
+    auth = current_app.extensions['auth']
 
     # Attempt to destroy the session
     if auth.destroy_session(request):
@@ -1,19 +1,154 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from datetime import datetime
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, current_app, jsonify, request
+from models.base import TIMESTAMP_FORMAT
 from models.user import User
 
+# Users serialized per chunk when the list is streamed
+STREAM_BATCH = 500
+
+# Operations accepted at most by one POST /api/v1/users/batch
+BATCH_MAX_SIZE = 10000
+
+# Attributes of a User that ?fields= may select
+USER_FIELDS = ('id', 'email', 'first_name', 'last_name',
+               'created_at', 'updated_at')
+
+
+def requested_fields() -> list:
+    """ Attributes selected by the comma separated ?fields= query
+    parameter, or None when it is absent
+    Raises ValueError for an unknown attribute
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return None
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in USER_FIELDS:
+            raise ValueError("Unknown field: {}".format(field))
+        fields.append(field)
+    return fields
+
+
+def list_query() -> dict:
+    """ Arguments of User.query from the filter, sort and limit query
+    parameters of GET /api/v1/users, or None when there are none
+    Raises ValueError for a parameter that can't be served by an index
+    """
+    query = {}
+    equal = {}
+    low = high = None
+    for name, value in request.args.items():
+        if name == 'fields':
+            continue
+        if name in ('email', 'first_name', 'last_name'):
+            equal[name] = value
+        elif name in ('created_after', 'created_before'):
+            try:
+                bound = datetime.strptime(value, TIMESTAMP_FORMAT)
+            except ValueError:
+                raise ValueError("{} must be formatted as {}".format(
+                    name, TIMESTAMP_FORMAT))
+            if name == 'created_after':
+                low = bound
+            else:
+                high = bound
+        elif name == 'sort':
+            attribute = value[1:] if value.startswith('-') else value
+            if attribute not in User.INDEXED:
+                raise ValueError("No index on {}".format(attribute))
+            query['sort'] = attribute
+            query['descending'] = value.startswith('-')
+        elif name == 'limit':
+            if not value.isdigit() or int(value) == 0:
+                raise ValueError("limit must be a positive integer")
+            query['limit'] = int(value)
+        else:
+            raise ValueError("No index on {}".format(name))
+    if equal:
+        query['equal'] = equal
+    if low is not None or high is not None:
+        query['ranges'] = {'created_at': (low, high)}
+    return query or None
+
+
+def not_modified(etag: str) -> Response:
+    """ 304 response if the request's If-None-Match matches `etag`,
+    else None
+    """
+    # Weak comparison: compressed responses carry the ETag as weak
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(payload, etag: str) -> Response:
+    """ JSON response of `payload` carrying `etag`
+    """
+    response = jsonify(payload)
+    response.set_etag(etag)
+    return response
+
+
+def stream_users(users: list, etag: str, fields: list = None) -> Response:
+    """ JSON response of `users`, with only `fields` if given,
+    serialized chunk by chunk as it is sent, carrying `etag`
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '['
+        for start in range(0, len(users), STREAM_BATCH):
+            chunk = dumps([user.to_dict(fields=fields)
+                           for user in users[start:start + STREAM_BATCH]],
+                          separators=(',', ':'))
+            yield (',' if start else '') + chunk[1:-1]
+        yield ']\n'
+    response = Response(generate(), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (all optional):
+      - fields: comma separated attributes to return
+      - email, first_name, last_name: values to match
+      - created_after (included), created_before (excluded):
+        bounds of created_at, formatted as TIMESTAMP_FORMAT
+      - sort: attribute to sort on, prefixed with - for descending
+        order (email, first_name, last_name or created_at)
+      - limit: number of users returned at most
     Return:
-      - list of all User objects JSON represented
+      - list of the matching User objects JSON represented,
+        streamed when there are many
+      - 304 if If-None-Match has the ETag of the current list
+      - 400 if a field is unknown or a parameter has no index
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    try:
+        fields = requested_fields()
+        query = list_query()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    etag = User.collection_etag()
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    all_users = User.all() if query is None else User.query(**query)
+    if len(all_users) > STREAM_BATCH:
+        return stream_users(all_users, etag, fields)
+    return with_etag([user.to_dict(fields=fields) for user in all_users],
+                     etag)
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -21,21 +156,33 @@ def view_one_user(user_id: str = None) -> str:
     """ GET /api/v1/users/:id
     Path parameter:
       - User ID
+    Query parameter:
+      - fields: comma separated attributes to return (optional)
     Return:
       - User object JSON represented
+      - 304 if If-None-Match has the ETag of the current User
       - 404 if the User ID doesn't exist
+      - 400 if a field is unknown
     """
     if user_id is None:
         abort(404)
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     if user_id == "me":
         if request.current_user is None:
             abort(404)
         user = request.current_user
-        return jsonify(user.to_json())
-    user = User.get(user_id)
+    else:
+        user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    etag = user.etag()
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return with_etag(user.to_dict(fields=fields), etag)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -88,7 +235,7 @@ def create_user() -> str:
             user.first_name = rj.get("first_name")
             user.last_name = rj.get("last_name")
             user.save()
-            return jsonify(user.to_json()), 201
+            return jsonify(user.to_dict()), 201
         except Exception as e:
             error_msg = "Can't create User: {}".format(e)
     return jsonify({'error': error_msg}), 400
@@ -124,4 +271,93 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
-    return jsonify(user.to_json()), 200
+    return jsonify(user.to_dict()), 200
+
+
+def batch_error(operation, deleted: set) -> str:
+    """ Why an operation of a batch is invalid, given the ids deleted
+    by the previous ones, or None if it is valid
+    """
+    if not isinstance(operation, dict):
+        return "Wrong format"
+    op = operation.get("op")
+    for key in ("email", "password", "first_name", "last_name"):
+        value = operation.get(key)
+        if value is not None and type(value) is not str:
+            return "{} must be a string".format(key)
+    if op == "create":
+        if operation.get("email", "") in ("", None):
+            return "email missing"
+        if operation.get("password", "") in ("", None):
+            return "password missing"
+        return None
+    if op not in ("update", "delete"):
+        return "op must be create, update or delete"
+    user_id = operation.get("id")
+    if type(user_id) is not str or user_id in deleted or \
+            User.get(user_id) is None:
+        return "Not found"
+    if op == "delete":
+        deleted.add(user_id)
+    return None
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def batch_users() -> str:
+    """ POST /api/v1/users/batch
+    JSON body: list of operations, applied in order, each one of
+      - {"op": "create", "email", "password", "first_name", "last_name"}
+      - {"op": "update", "id", "first_name", "last_name"}
+      - {"op": "delete", "id"}
+    Every operation is validated before any is applied, and the users
+    are written to file once.
+    Return:
+      - list of the results of each operation: its status and the
+        User object JSON represented, except for deletions
+      - 400 with the index and error of each invalid operation if one
+        is invalid, in which case nothing is applied
+    """
+    try:
+        operations = request.get_json()
+    except Exception as e:
+        operations = None
+    if type(operations) is not list:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(operations) > BATCH_MAX_SIZE:
+        return jsonify({'error': "At most {} operations".format(
+            BATCH_MAX_SIZE)}), 400
+
+    deleted = set()
+    errors = []
+    for index, operation in enumerate(operations):
+        error_msg = batch_error(operation, deleted)
+        if error_msg is not None:
+            errors.append({'index': index, 'error': error_msg})
+    if errors:
+        return jsonify({'error': "Invalid batch", 'errors': errors}), 400
+
+    results = []
+    for operation in operations:
+        op = operation["op"]
+        if op == "delete":
+            User.get(operation["id"]).remove(flush=False)
+            results.append({'status': 200})
+            continue
+        if op == "create":
+            user = User()
+            user.email = operation["email"]
+            user.password = operation["password"]
+            user.first_name = operation.get("first_name")
+            user.last_name = operation.get("last_name")
+        else:
+            user = User.get(operation["id"])
+            if operation.get('first_name') is not None:
+                user.first_name = operation.get('first_name')
+            if operation.get('last_name') is not None:
+                user.last_name = operation.get('last_name')
+        user.save(flush=False)
+        results.append({'status': 201 if op == "create" else 200,
+                        'user': user.to_dict()})
+    if operations:
+        User.save_to_file()
+    return jsonify(results), 200
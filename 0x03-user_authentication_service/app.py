@@ -3,12 +3,51 @@
 """
 
 
-from flask import Flask, jsonify, request, abort, redirect, make_response
+import os
+from flask import (Flask, Response, jsonify, request, abort, redirect,
+                   make_response)
 from auth import Auth
+from rate_limit import LoginThrottle
+import compression
+import json_provider
+import memory
+import metrics
+import profiler
+import timing
 
 AUTH = Auth()
+THROTTLE = LoginThrottle()
 
 app = Flask(__name__)
+# orjson when importable
+json_provider.init_app(app)
+
+
+@app.before_request
+def begin_unit_of_work() -> None:
+    """Collect the request's database writes into one transaction
+    """
+    AUTH.begin_request()
+
+
+@app.after_request
+def commit_unit_of_work(response):
+    """Commit the request's writes before the response is sent, so
+    that a failed commit is reported instead of a false success.
+    Server errors, including the 500 Flask builds for an unhandled
+    exception, are left for end_unit_of_work to roll back
+    """
+    if response.status_code < 500:
+        AUTH.commit_request()
+    return response
+
+
+@app.teardown_appcontext
+def end_unit_of_work(exception=None) -> None:
+    """Roll back anything left uncommitted, e.g. after an error,
+    and release the request's database session
+    """
+    AUTH.end_request()
 
 
 @app.route('/', methods=['GET'])
@@ -27,6 +66,10 @@ def users() -> str:
     email = request.form.get('email')
     password = request.form.get('password')
 
+    # Throttle before the password gets hashed, taken email or not
+    if not THROTTLE.allow_signup(request.remote_addr):
+        return jsonify({"message": "too many signups"}), 429
+
     # regsiter user if user does not exist
     try:
         user = AUTH.register_user(email, password)
@@ -45,12 +88,12 @@ def login():
     if not email or not password:
         abort(401)
 
-    # Check if the login credentials are valid
-    if not AUTH.valid_login(email, password):
-        abort(401)
+    # Throttle before any password gets hashed
+    if not THROTTLE.allow(request.remote_addr, email):
+        return jsonify({"message": "too many login attempts"}), 429
 
-    # Create a new session for the user
-    session_id = AUTH.create_session(email)
+    # Check the login credentials and create a new session for the user
+    session_id = AUTH.login(email, password)
 
     if not session_id:
         abort(401)
@@ -92,8 +135,8 @@ def logout():
     if not user:
         abort(403)
 
-    # Destroy the session for the found user
-    AUTH.destroy_session(user.id)
+    # Destroy this session of the found user
+    AUTH.destroy_session(user.id, session_id)
 
     # Redirect to the home page
     return redirect("/")
@@ -179,5 +222,99 @@ def update_password():
     return jsonify({"email": email, "message": "Password updated"}), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """GET /metrics
+    Response:
+        - The metrics of the service in the Prometheus text format.
+    """
+    return Response(metrics.render(AUTH, THROTTLE),
+                    content_type=metrics.CONTENT_TYPE)
+
+
+def require_admin() -> None:
+    """Aborts with 403 unless the session's user has an email listed
+    in the ADMIN_EMAILS environment variable (comma separated)
+    """
+    admins = {email.strip().lower()
+              for email in os.getenv('ADMIN_EMAILS', '').split(',')
+              if email.strip()}
+    user = AUTH.get_user_from_session_id(request.cookies.get("session_id"))
+    if user is None or user.email.lower() not in admins:
+        abort(403)
+
+
+@app.route('/admin/memory', methods=['GET'])
+def memory_usage():
+    """GET /admin/memory
+    Response:
+        - Approximate bytes of the mapped objects alive, of the caches
+          and of the login throttle, and the state of tracemalloc.
+        - 403 if the user is not an admin.
+    """
+    require_admin()
+    return jsonify(memory.report(AUTH, THROTTLE))
+
+
+@app.route('/admin/memory/snapshots', methods=['POST'])
+def memory_snapshot():
+    """POST /admin/memory/snapshots
+    Starts tracing allocations if needed and takes a snapshot.
+    Response:
+        - The id of the snapshot.
+        - 403 if the user is not an admin.
+    """
+    require_admin()
+    return jsonify({"id": memory.take_snapshot()}), 201
+
+
+@app.route('/admin/memory/snapshots/<int:first>/diff/<int:second>',
+           methods=['GET'])
+def memory_diff(first: int, second: int):
+    """GET /admin/memory/snapshots/<first>/diff/<second>
+    Query parameter:
+        - limit: number of source lines returned (optional).
+    Response:
+        - The source lines whose allocations grew the most between
+          the two snapshots.
+        - 404 if a snapshot does not exist.
+        - 403 if the user is not an admin.
+    """
+    require_admin()
+    limit = request.args.get('limit', 20, type=int)
+    try:
+        return jsonify(memory.diff(first, second, limit))
+    except KeyError:
+        abort(404)
+
+
+@app.route('/admin/memory/snapshots', methods=['DELETE'])
+def memory_stop():
+    """DELETE /admin/memory/snapshots
+    Stops tracing allocations and forgets every snapshot.
+    Response:
+        - An empty JSON object.
+        - 403 if the user is not an admin.
+    """
+    require_admin()
+    memory.stop()
+    return jsonify({})
+
+
+# Gzip large responses, such as /metrics, for clients accepting it
+compression.init_app(app)
+
+# Count requests and password hashes for /metrics
+metrics.init_app(app)
+
+# Time session lookups and commits when SERVER_TIMING is set
+if timing.init_app(app):
+    timing.instrument(AUTH, 'get_user_from_session_id', 'current_user')
+    timing.instrument(AUTH, 'commit_request', 'commit')
+
+# Profile a sample of requests when PROFILE_RATE or PROFILE_SECRET is set
+profiler.init_app(app)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="5000")
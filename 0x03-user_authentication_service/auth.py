@@ -3,14 +3,51 @@
 
 
 import bcrypt
-from db import DB
+import hashlib
+import os
+from cache import TTLCache
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from time import monotonic, perf_counter_ns
+from db import DB, chunked, utcnow
 from user import User
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from typing import Union
+from typing import Iterable, Tuple, Union
 from uuid import uuid4
 from typing import Optional
 
 
+# Seconds between two purges of expired sessions and reset tokens
+PURGE_INTERVAL = 300
+
+# Seconds a session-to-user mapping may be served from memory, and
+# number of mappings kept, unless SESSION_CACHE_TTL/SESSION_CACHE_SIZE
+# are set. Other processes' logouts are seen after this delay at worst.
+SESSION_CACHE_TTL = 30
+SESSION_CACHE_SIZE = 10000
+
+# What get_user_from_session_id returns
+SessionUser = namedtuple("SessionUser", ["id", "email"])
+
+# Seconds a password reset token stays valid, unless
+# RESET_TOKEN_DURATION is set
+RESET_TOKEN_DURATION = 900
+
+# Called with the duration in nanoseconds of every password hash
+# or check done in this process
+HASH_LISTENERS = []
+
+
+def _timed_hash(start: int) -> None:
+    """Reports a password hash started at `start` to HASH_LISTENERS.
+    """
+    duration = perf_counter_ns() - start
+    for listener in HASH_LISTENERS:
+        listener(duration)
+
+
 def _hash_password(password: str) -> str:
     """Hashes a password using bcrypt's hashpw with a salt.
 
@@ -20,7 +57,32 @@ def _hash_password(password: str) -> str:
         Returns:
             bytes: The salted, hashed password as a string.
     """
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    start = perf_counter_ns()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    _timed_hash(start)
+    return hashed
+
+
+def _check_password(password: str, hashed_password: bytes) -> bool:
+    """Checks a password against its bcrypt hash.
+
+        Returns:
+            bool: True if the password matches, False otherwise.
+    """
+    start = perf_counter_ns()
+    valid = bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    _timed_hash(start)
+    return valid
+
+
+def _hash_token(token: str) -> str:
+    """Hashes a reset token for storage, so that the database never
+    holds a usable token.
+
+        Returns:
+            str: The SHA-256 hex digest of the token.
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
 
 
 def _generate_uuid() -> str:
@@ -38,13 +100,53 @@ class Auth:
     """Auth class to interact with the authentication db.
     """
 
-    def __init__(self):
-        """_summary_
+    def __init__(self, db: DB = None):
+        """Initializes Auth on the given DB, or on a new default one.
+        """
+        self._db = db if db is not None else DB()
+        try:
+            # Session lifetime in seconds, 0 or less never expires
+            self.session_duration = int(os.getenv('SESSION_DURATION', 0))
+        except (ValueError, TypeError):
+            self.session_duration = 0
+        try:
+            self.reset_token_duration = int(
+                os.getenv('RESET_TOKEN_DURATION', RESET_TOKEN_DURATION))
+        except (ValueError, TypeError):
+            self.reset_token_duration = RESET_TOKEN_DURATION
+        self._next_purge = 0.0
+        try:
+            cache_ttl = float(
+                os.getenv('SESSION_CACHE_TTL', SESSION_CACHE_TTL))
+            cache_size = int(
+                os.getenv('SESSION_CACHE_SIZE', SESSION_CACHE_SIZE))
+        except (ValueError, TypeError):
+            cache_ttl, cache_size = SESSION_CACHE_TTL, SESSION_CACHE_SIZE
+        # session_id -> SessionUser, read through by
+        # get_user_from_session_id
+        self._session_users = TTLCache(ttl=cache_ttl, max_size=cache_size)
+
+    def begin_request(self) -> None:
+        """Starts the unit of work of a request: its writes are
+        committed together by commit_request().
+        """
+        self._db.begin()
+
+    def commit_request(self) -> None:
+        """Commits the writes of the current request in one transaction.
         """
-        self._db = DB()
+        self._db.commit()
+
+    def end_request(self) -> None:
+        """Rolls back whatever the request left uncommitted
+        and releases its database session.
+        """
+        self._db.end()
 
     def register_user(self, email: str, password: str) -> Union[None, User]:
         """Register a user with a given email and password.
+            This is a single INSERT: duplicates are rejected by the
+            unique index on users.email, even under concurrency.
 
             Args:
                 email (str): User's email address.
@@ -58,16 +160,43 @@ class Auth:
                 User: The newly created User object.
             """
         try:
-            # find the user with the given email
-            self._db.find_user_by(email=email)
-        except NoResultFound:
             # add user to database
             return self._db.add_user(email, _hash_password(password))
-
-        else:
+        except IntegrityError:
             # if user already exists, throw error
             raise ValueError('User {} already exists'.format(email))
 
+    def register_users(self, users: Iterable[Tuple[str, str]],
+                       chunk_size: int = 500, workers: int = None) -> int:
+        """Registers many users at once, skipping emails already taken.
+
+            Passwords are hashed in parallel across `workers` processes
+            and users are inserted `chunk_size` at a time.
+
+            Args:
+                users (Iterable[Tuple[str, str]]): (email, password) pairs.
+                chunk_size (int): Number of users per transaction.
+                workers (int): Hashing processes, one per CPU by default.
+
+            Returns:
+                int: The number of users created.
+            """
+        created = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for chunk in chunked(users, chunk_size):
+                existing = self._db.existing_emails(
+                    email for email, _ in chunk)
+                fresh = {}
+                for email, password in chunk:
+                    if email not in existing:
+                        fresh.setdefault(email, password)
+                hashes = pool.map(_hash_password, fresh.values(),
+                                  chunksize=max(1, len(fresh) // 64))
+                created += self._db.add_users(
+                    {"email": email, "hashed_password": hashed}
+                    for email, hashed in zip(fresh, hashes))
+        return created
+
     def valid_login(self, email: str, password: str) -> bool:
         """
         Validates a login attempt.
@@ -85,11 +214,34 @@ class Auth:
         except NoResultFound:
             return False
         # check validity of password
-        return bcrypt.checkpw(password.encode('utf-8'), user.hashed_password)
+        return _check_password(password, user.hashed_password)
+
+    def login(self, email: str, password: str) -> Optional[str]:
+        """
+        Checks the credentials and creates a session in one go,
+        loading the user only once.
+
+        Args:
+            email (str): The user's email.
+            password (str): The password provided.
+
+        Returns:
+            Optional[str]: The new session ID, or None if the
+            credentials are invalid.
+        """
+        try:
+            user = self._db.find_user_by(columns=("id", "hashed_password"),
+                                         email=email)
+        except NoResultFound:
+            return None
+        if not _check_password(password, user.hashed_password):
+            return None
+        return self._new_session(user.id)
 
     def create_session(self, email: str) -> str:
         """
         Creates a new session for a user with the given email.
+        Sessions on other devices stay valid.
         Args:
             email (str): The user's email.
         Returns:
@@ -99,59 +251,132 @@ class Auth:
         """
         try:
             # Finds the user by email
-            user = self._db.find_user_by(email=email)
+            user = self._db.find_user_by(columns=("id",), email=email)
         except NoResultFound:
             # raise an exception If no user is found,
             return None
 
+        return self._new_session(user.id)
+
+    def _new_session(self, user_id: int) -> str:
+        """
+        Stores a new session with its expiry for the given user.
+        Returns:
+            str: The session ID.
+        """
         # Generate a new session ID (UUID)
         session_id = _generate_uuid()
 
-        # Update the user's session_id in the db
-        self._db.update_user(user.id, session_id=session_id)
+        # Store the session with its expiry in the db
+        expires_at = None
+        if self.session_duration > 0:
+            expires_at = utcnow() + timedelta(seconds=self.session_duration)
+        self._db.add_session(user_id, session_id, expires_at)
+        self._forget_sessions(user_id, session_id)
+        self._purge_expired()
 
         # Return the new session ID
         return session_id
 
+    def _purge_expired(self) -> None:
+        """
+        Deletes expired sessions and reset tokens,
+        at most once every PURGE_INTERVAL.
+        """
+        now = monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + PURGE_INTERVAL
+        self._db.purge_expired_sessions()
+        self._db.purge_expired_reset_tokens()
+
     def get_user_from_session_id(
-            self, session_id: Optional[str]) -> Optional[User]:
+            self, session_id: Optional[str]) -> Optional[SessionUser]:
         """
-        Takes a session_id string and returns the corresponding User or None.
+        Takes a session_id string and returns the corresponding user or None.
+        Only the user's `id` and `email` are loaded, and they are served
+        from an in-process cache while it holds the session.
         Returns:
-            Optional[User]: The user associated with the session ID,
-            or None if not found.
+            Optional[SessionUser]: The `id` and `email` of the user
+            associated with the session ID, or None if not found or
+            expired.
         """
         if session_id is None:
             return None
 
+        user = self._session_users.get(session_id)
+        if user is not None:
+            return user
+        # Read before the query: a logout committed meanwhile
+        # must not be undone by caching what the query saw
+        generation = self._session_users.generation
+
         try:
-            # find the user by session_id
-            user = self._db.find_user_by(session_id=session_id)
+            # find the user owning the session
+            row = self._db.find_session_user(session_id)
         except NoResultFound:
             # Return None if no user is found
             return None
 
+        # Cache the mapping, never beyond the session's expiry
+        user = SessionUser(row.id, row.email)
+        ttl = None
+        if row.expires_at is not None:
+            ttl = (row.expires_at - utcnow()).total_seconds()
+        self._session_users.set(session_id, user, ttl, generation)
         return user
 
-    def destroy_session(self, user_id: int) -> None:
+    def session_cache_stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the session cache.
+        """
+        return self._session_users.stats()
+
+    def caches(self) -> dict:
+        """
+        Returns the in-memory caches of this instance and of its DB
+        by name, for memory accounting.
+        """
+        return dict(self._db.caches(), session_cache=self._session_users)
+
+    def storage_stats(self) -> dict:
+        """
+        Returns row counts, active sessions, database file sizes and
+        the duration of the last commit that wrote something.
+        """
+        return {"rows": self._db.count_rows(),
+                "active_sessions": self._db.count_active_sessions(),
+                "file_sizes": self._db.file_sizes(),
+                "last_commit_seconds": self._db.last_commit_seconds}
+
+    def destroy_session(self, user_id: int, session_id: str = None) -> None:
         """
-        Takes a user_id and updates the user's session ID to None.
+        Takes a user_id and deletes the given session of that user,
+        or all of the user's sessions when no session_id is given.
         Returns:
             None
         """
-        try:
-            # Find user user_id
-            user = self._db.find_user_by(id=user_id)
+        self._db.delete_sessions(user_id, session_id)
+        self._forget_sessions(user_id, session_id)
+        return None
 
-        except NoResultFound:
-            return None
+    def _forget_sessions(self, user_id: int, session_id: str = None) -> None:
+        """
+        Drops the given session of a user, or all of the user's sessions,
+        from the session cache once the current writes are committed.
+        """
+        if session_id is not None:
+            self._db.after_commit(
+                lambda: self._session_users.discard(session_id))
         else:
-            user.session_id = None
-            return None
+            self._db.after_commit(lambda: self._session_users.discard_where(
+                lambda user: user.id == user_id))
 
     def get_reset_password_token(self, email: str) -> str:
         """
         Gets a user by email and generates a password reset token.
+        Only a hash of the token is stored; it expires after
+        RESET_TOKEN_DURATION seconds and can be used once.
         Returns:
             str: The generated reset token (UUID).
 
@@ -160,30 +385,39 @@ class Auth:
         """
         try:
             # Find the user by email
-            user = self._db.find_user_by(email=email)
-
-            # if user is not found, Raise a ValueError
-            # Generate a new UUID token
-            # Update the user's reset_token field with the new token
-            # Return the generated token
+            user = self._db.find_user_by(columns=("id",), email=email)
         except NoResultFound:
+            # if user is not found, Raise a ValueError
             raise ValueError
         else:
-            user.reset_token = _generate_uuid()
-            return user.reset_token
+            # Generate a new UUID token and store its hash
+            reset_token = _generate_uuid()
+            expires_at = utcnow() + timedelta(
+                seconds=self.reset_token_duration)
+            self._db.add_reset_token(user.id, _hash_token(reset_token),
+                                     expires_at)
+            self._purge_expired()
+            return reset_token
 
     def update_password(self, reset_token: str, password: str) -> None:
         """Updates the user's password using the reset_token.
         Raises:
-            ValueError: If no user is found with the reset_token.
+            ValueError: If the reset_token is invalid, expired or used.
         """
+        token_hash = _hash_token(reset_token)
         try:
-            # Gets the user by the reset_token
-            user = self._db.find_user_by(reset_token=reset_token)
+            # Turn down unknown tokens with a read, before any hash
+            self._db.find_reset_token_user(token_hash)
+            # Hash before consuming the token: the deletion takes the
+            # database write lock, which bcrypt must not hold up
+            hashed_password = _hash_password(password)
+            # Consume the token and store the new password together,
+            # getting the user the token was issued to
+            user_id = self._db.consume_reset_token(
+                token_hash, hashed_password=hashed_password)
         except NoResultFound:
             # Raise a ValueError if the reset_token is invalid,
             raise ValueError
         else:
-            user.hashed_password = _hash_password(password)
-            user.reset_token = None
+            self._forget_sessions(user_id)
             return None
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+In-process caches used in front of the database.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+
+class NegativeCache:
+    """
+    Remembers lookups that found nothing for a short time, so that
+    repeated bogus emails or session ids do not reach the database.
+
+    Keys expire after `ttl` seconds and at most `max_size` keys are
+    kept, the oldest being dropped first.
+
+    `generation` counts invalidations: a lookup reads it before
+    querying and passes it to add(), so that a miss is not recorded
+    if a row matching it was committed while the query ran.
+    """
+
+    def __init__(self, ttl: float = 5.0, max_size: int = 10000):
+        """Initializes an empty cache."""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.generation = 0
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Checks whether `key` is a known, unexpired miss."""
+        expires_at = self._expiry.get(key)
+        if expires_at is None:
+            return False
+        if expires_at > monotonic():
+            return True
+        with self._lock:
+            self._expiry.pop(key, None)
+        return False
+
+    def add(self, key: Hashable, generation: int = None) -> None:
+        """Records `key` as a miss, unless keys were discarded since
+        `generation` was read."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._expiry.pop(key, None)
+            self._expiry[key] = monotonic() + self.ttl
+            if len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        """Forgets `key`, typically because a row now matches it."""
+        with self._lock:
+            self.generation += 1
+            self._expiry.pop(key, None)
+
+    def clear(self) -> None:
+        """Forgets every key."""
+        with self._lock:
+            self.generation += 1
+            self._expiry.clear()
+
+    def __len__(self) -> int:
+        """Number of keys currently held."""
+        return len(self._expiry)
+
+
+class TTLCache:
+    """
+    Bounded read-through cache whose entries expire after `ttl`
+    seconds, or earlier when stored with a shorter lifetime.
+
+    The least recently used entry is evicted once `max_size` entries
+    are held. `hits` and `misses` count lookups for monitoring.
+
+    `generation` counts invalidations: a read-through fill reads it
+    before querying and passes it to set(), so that a value read
+    before an invalidation is not stored after it.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_size: int = 10000):
+        """Initializes an empty cache."""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Returns the value cached for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: Any, ttl: float = None,
+            generation: int = None) -> None:
+        """Caches `value` for `key` during `ttl` seconds at most, unless
+        entries were discarded since `generation` was read."""
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (value, monotonic() + ttl)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        """Forgets the entry of `key`."""
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> None:
+        """Forgets every entry whose value matches `predicate`."""
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, (value, _) in self._entries.items()
+                        if predicate(value)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Forgets every entry."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._entries)}
+
+    def __len__(self) -> int:
+        """Number of entries currently held."""
+        return len(self._entries)
@@ -3,35 +3,333 @@
 DB module for managing user operations
 """
 
-from sqlalchemy import create_engine
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import islice
+from time import perf_counter
+from typing import (Callable, Dict, Iterable, Iterator, List, Sequence,
+                    Set, Union)
+from sqlalchemy import (Column, Integer, Table, and_, bindparam, delete,
+                        create_engine, event, func, or_, select, text,
+                        update)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import Row
 from sqlalchemy.orm.session import Session
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
 
-from user import Base, User
+from cache import NegativeCache
+from user import Base, ResetToken, User, UserSession
+
+# Engine used unless DB_URL is set
+DEFAULT_URL = "sqlite:///a.db"
+
+# Applied to every new SQLite connection: WAL lets readers proceed
+# while a write is in flight, NORMAL sync is safe under WAL, and
+# mmap avoids copying pages through read() calls.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Seconds during which a lookup that found no user is not repeated
+NEGATIVE_TTL = 5.0
+
+# Version of the schema this module expects; bump it when adding
+# an entry to MIGRATIONS
+SCHEMA_VERSION = 3
+
+# Statements bringing a database from the previous version to the
+# given one. Tables missing altogether are created by create_all,
+# so migrations only need to upgrade existing tables.
+MIGRATIONS = {
+    1: [
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email "
+        "ON users (email)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_session_id "
+        "ON users (session_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_reset_token "
+        "ON users (reset_token)",
+    ],
+    # sessions table, created by create_all
+    2: [],
+    # reset_tokens table, created by create_all
+    3: [],
+}
+
+# Columns of the users table given a unique index by a migration;
+# their existing values are checked for duplicates beforehand
+MIGRATION_UNIQUE_COLUMNS = {
+    1: ("email", "session_id", "reset_token"),
+}
+
+# Columns find_user_by may filter on or project
+USER_COLUMNS = frozenset(User.__table__.columns.keys())
+
+# A session's last_seen_at is only rewritten once this much time passed,
+# so that reads do not turn into a write each
+LAST_SEEN_RESOLUTION = timedelta(seconds=60)
+
+schema_version = Table(
+    'schema_version', Base.metadata,
+    Column('version', Integer, primary_key=True),
+)
+
+
+def utcnow() -> datetime:
+    """Returns the current UTC time as a naive datetime, as stored
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Yields successive lists of at most `size` items from `iterable`
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 class DB:
     """DB class for interacting with the database"""
 
-    def __init__(self) -> None:
+    def __init__(self, persistent: bool = None, url: str = None,
+                 pool_size: int = None) -> None:
         """Initialize a new DB instance
+
+        Args:
+            persistent (bool): Keep existing data and upgrade the schema
+            in place instead of recreating every table. Defaults to the
+            DB_PERSISTENT environment variable.
+            url (str): Engine URL. Defaults to the DB_URL environment
+            variable, then to DEFAULT_URL.
+            pool_size (int): Number of pooled connections. Defaults to
+            the DB_POOL_SIZE environment variable, then to the
+            SQLAlchemy default for the URL.
         """
-        self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
+        if persistent is None:
+            persistent = os.getenv("DB_PERSISTENT", "").lower() in (
+                "1", "true", "yes")
+        if url is None:
+            url = os.getenv("DB_URL", DEFAULT_URL)
+        if pool_size is None and os.getenv("DB_POOL_SIZE"):
+            pool_size = int(os.getenv("DB_POOL_SIZE"))
+        self._engine = self._create_engine(url, pool_size)
+        if not persistent:
+            Base.metadata.drop_all(self._engine)
         Base.metadata.create_all(self._engine)
-        self.__session = None
+        self._migrate()
+        # One session per thread, i.e. per Flask request
+        self._sessions = scoped_session(
+            sessionmaker(bind=self._engine, expire_on_commit=False))
+        # Whether the current thread runs a unit of work
+        self._local = threading.local()
+        self._misses = NegativeCache(ttl=NEGATIVE_TTL)
+        # find_user_by statements keyed by (filter columns, projection,
+        # columns filtered on NULL)
+        self._statements = {}
+        # Duration in seconds of the last commit that wrote something
+        self.last_commit_seconds = None
+
+    @staticmethod
+    def _create_engine(url: str, pool_size: int = None):
+        """Creates the engine, tuning SQLite connections as they open
+        """
+        kwargs = {"echo": False}
+        is_sqlite = url.startswith("sqlite")
+        if is_sqlite:
+            # Pooled connections are handed from thread to thread
+            kwargs["connect_args"] = {"check_same_thread": False}
+        if pool_size is not None:
+            kwargs["poolclass"] = QueuePool
+            kwargs["pool_size"] = pool_size
+        engine = create_engine(url, **kwargs)
+
+        if is_sqlite:
+            @event.listens_for(engine, "connect")
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for pragma in SQLITE_PRAGMAS:
+                    cursor.execute(pragma)
+                cursor.close()
+        return engine
+
+    def _migrate(self) -> None:
+        """Applies the pending MIGRATIONS and records the schema version
+        """
+        with self._engine.begin() as conn:
+            current = conn.execute(
+                select(func.max(schema_version.c.version))).scalar() or 0
+            pending = range(current + 1, SCHEMA_VERSION + 1)
+            # Check every migration before applying any, so that the
+            # schema is never left half upgraded
+            for version in pending:
+                for column in MIGRATION_UNIQUE_COLUMNS.get(version, ()):
+                    self._check_unique(conn, column)
+            for version in pending:
+                for statement in MIGRATIONS.get(version, []):
+                    conn.execute(text(statement))
+                conn.execute(schema_version.insert().values(version=version))
+
+    @staticmethod
+    def _check_unique(conn, column: str) -> None:
+        """Fails if several users share a value of `column`
+
+        Raises:
+            RuntimeError: Naming the column and a few duplicated values,
+            which must be resolved before the unique index can be built.
+        """
+        users_column = User.__table__.c[column]
+        duplicates = conn.execute(
+            select(users_column).where(users_column.isnot(None))
+            .group_by(users_column).having(func.count() > 1).limit(5)
+        ).scalars().all()
+        if duplicates:
+            raise RuntimeError(
+                f"Cannot create the unique index on users.{column}: "
+                f"duplicated values such as "
+                f"{', '.join(repr(value) for value in duplicates)} "
+                f"must be resolved first")
 
     @property
     def _session(self) -> Session:
-        """Memoized session object for interacting with the db
+        """Session object of the current thread for interacting with the db
+        """
+        return self._sessions()
+
+    def remove_session(self) -> None:
+        """Closes the session of the current thread, e.g. at the end
+        of a request, and returns its connection to the pool
+        """
+        self._sessions.remove()
+
+    def begin(self) -> None:
+        """Starts a unit of work on the current thread: until commit(),
+        writes are only flushed, so that they all land in one transaction
+        """
+        self._local.in_unit_of_work = True
+        self._local.on_commit = []
+
+    def commit(self) -> None:
+        """Commits the writes of the current unit of work
+        """
+        wrote = getattr(self._local, "wrote", False)
+        self._local.wrote = False
+        callbacks = getattr(self._local, "on_commit", [])
+        self._local.on_commit = []
+        start = perf_counter()
+        try:
+            self._session.commit()
+        except Exception:
+            self._session.rollback()
+            raise
+        if wrote:
+            self.last_commit_seconds = perf_counter() - start
+        for callback in callbacks:
+            callback()
+
+    def end(self) -> None:
+        """Ends the current unit of work, rolling back anything not
+        committed, and releases the session
+        """
+        self._local.in_unit_of_work = False
+        self._local.on_commit = []
+        try:
+            self._session.rollback()
+        finally:
+            self.remove_session()
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """Runs `callback` once the writes made so far are committed:
+        right away outside a unit of work, after a successful commit()
+        inside one, and never if the unit of work is rolled back
+        """
+        if getattr(self._local, "in_unit_of_work", False):
+            self._local.on_commit.append(callback)
+        else:
+            callback()
+
+    @contextmanager
+    def unit_of_work(self):
+        """Runs the enclosed writes in one transaction, committed on
+        success and rolled back on error
+        """
+        self.begin()
+        try:
+            yield self
+            self.commit()
+        finally:
+            self.end()
+
+    def count_rows(self) -> Dict[str, int]:
+        """Counts the rows of every table
+
+        Returns:
+            Dict[str, int]: The number of rows by table name.
+        """
+        return {
+            model.__tablename__: self._session.execute(
+                select(func.count()).select_from(model)).scalar()
+            for model in (User, UserSession, ResetToken)
+        }
+
+    def count_active_sessions(self) -> int:
+        """Counts the sessions that have not expired
+
+        Returns:
+            int: The number of active sessions.
+        """
+        return self._session.execute(
+            select(func.count()).select_from(UserSession).where(or_(
+                UserSession.expires_at.is_(None),
+                UserSession.expires_at > utcnow()))).scalar()
+
+    def caches(self) -> dict:
+        """Caches kept in memory by this instance
+
+        Returns:
+            dict: The caches by name.
         """
-        if self.__session is None:
-            DBSession = sessionmaker(bind=self._engine)
-            self.__session = DBSession()
-        return self.__session
+        return {"negative_cache": self._misses}
+
+    def file_sizes(self) -> Dict[str, int]:
+        """Sizes of the files of a SQLite database, WAL included
+
+        Returns:
+            Dict[str, int]: The size in bytes by file name, empty for
+            an in-memory or non-SQLite database.
+        """
+        url = self._engine.url
+        if url.get_backend_name() != "sqlite" or not url.database or \
+                url.database == ":memory:":
+            return {}
+        sizes = {}
+        for suffix in ("", "-wal"):
+            path = url.database + suffix
+            if os.path.exists(path):
+                sizes[path] = os.path.getsize(path)
+        return sizes
+
+    def _commit(self) -> None:
+        """Commits now, or only flushes inside a unit of work
+        """
+        if getattr(self._local, "in_unit_of_work", False):
+            self._session.flush()
+            self._local.wrote = True
+        else:
+            start = perf_counter()
+            self._session.commit()
+            self.last_commit_seconds = perf_counter() - start
 
     def add_user(self, email: str, hashed_password: str) -> User:
         """Adds a new user to the db.
@@ -42,6 +340,10 @@ class DB:
 
         Returns:
             User: The User object created and added to the db.
+
+        Raises:
+            IntegrityError: If the email is already registered; the
+            unique index on users.email rejects the INSERT.
         """
         # Creates a new user instance
         new_user = User(email=email, hashed_password=hashed_password)
@@ -49,21 +351,120 @@ class DB:
         # Adds the new user to the session
         self._session.add(new_user)
 
-        # Commits the transaction to the db
-        self._session.commit()
+        # Commits the transaction to the db, or flushes it
+        # inside a unit of work so that the new id is known
+        try:
+            self._commit()
+        except IntegrityError:
+            self._session.rollback()
+            raise
+
+        # Lookups that missed before may now match the new user
+        self._forget_misses(email=email, id=new_user.id)
 
         # Returns the newly created user object
         return new_user
 
-    def find_user_by(self, **kwargs) -> User:
+    def existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """Returns which of the given emails belong to a user, in a
+        single query.
+        """
+        emails = list(emails)
+        if not emails:
+            return set()
+        query = select(User.email).where(User.email.in_(emails))
+        return set(self._session.execute(query).scalars())
+
+    def add_users(self, rows: Iterable[dict], chunk_size: int = 500) -> int:
+        """Adds many users to the db, skipping emails already registered.
+
+        Each chunk costs one query to find duplicates and one
+        executemany INSERT committed in its own transaction. A chunk
+        holding an email registered concurrently is retried row by row.
+
+        Args:
+            rows (Iterable[dict]): Mappings with `email` and
+            `hashed_password` keys.
+            chunk_size (int): Number of rows per transaction.
+
+        Returns:
+            int: The number of users added.
+        """
+        added = 0
+        for chunk in chunked(rows, chunk_size):
+            existing = self.existing_emails(row["email"] for row in chunk)
+            fresh = {}
+            for row in chunk:
+                if row["email"] not in existing:
+                    fresh.setdefault(row["email"], {
+                        "email": row["email"],
+                        "hashed_password": row["hashed_password"],
+                    })
+            if not fresh:
+                continue
+            try:
+                with self._session.begin_nested():
+                    self._session.execute(User.__table__.insert(),
+                                          list(fresh.values()))
+            except IntegrityError:
+                # An email was registered since existing_emails()
+                fresh = self._insert_new_users(fresh)
+            self._commit()
+            for email in fresh:
+                self._forget_misses(email=email)
+            added += len(fresh)
+        return added
+
+    def _insert_new_users(self, rows: Dict[str, dict]) -> Dict[str, dict]:
+        """Inserts users one by one, each under a savepoint, skipping
+        those whose email is taken
+
+        Returns:
+            Dict[str, dict]: The rows inserted, by email.
+        """
+        inserted = {}
+        for email, row in rows.items():
+            try:
+                with self._session.begin_nested():
+                    self._session.execute(User.__table__.insert(), [row])
+            except IntegrityError:
+                continue
+            inserted[email] = row
+        return inserted
+
+    def _user_statement(self, keys: tuple, columns: tuple = None,
+                        nulls: tuple = ()):
+        """Returns the cached SELECT filtering on `keys` with one bound
+        parameter per key, except `nulls` which must be NULL, loading
+        either `columns` or the whole User
+        """
+        statement = self._statements.get((keys, columns, nulls))
+        if statement is None:
+            table = User.__table__
+            if columns:
+                statement = select(*(table.c[name] for name in columns))
+            else:
+                statement = select(User)
+            statement = statement.where(and_(*(
+                table.c[key].is_(None) if key in nulls
+                else table.c[key] == bindparam(key) for key in keys
+            ))).limit(1)
+            self._statements[(keys, columns, nulls)] = statement
+        return statement
+
+    def find_user_by(self, columns: Sequence[str] = None,
+                     **kwargs) -> Union[User, Row]:
         """Finds the first user that matches the filters
         specified in the keyword arguments.
 
         Args:
+            columns (Sequence[str]): Optional column names to load
+            instead of the full User, e.g. ("id", "email").
             kwargs: Arbitrary keyword arguments representing the filters.
 
         Returns:
-            User: The first user found that matches the criteria.
+            User: The first user found that matches the criteria, or a
+            lightweight row exposing only `columns` when given.
 
         Raises:
             NoResultFound: If no user is found matching the criteria.
@@ -73,17 +474,41 @@ class DB:
         if not kwargs:
             raise InvalidRequestError("No keyword arguments provided")
 
-        # Validate if the keyword args correspond
-        # to valid fields in the User model
-        for key in kwargs.keys():
-            if not hasattr(User, key):
+        # Validate if the keyword args and projected columns
+        # correspond to valid fields in the User model
+        keys = tuple(sorted(kwargs))
+        if columns is not None:
+            columns = tuple(columns)
+        for key in keys + (columns or ()):
+            if key not in USER_COLUMNS:
                 raise InvalidRequestError(f"Invalid field: {key}")
 
+        # Single-column lookups that recently found nothing
+        # are answered without a query
+        miss_key = None
+        generation = self._misses.generation
+        if len(kwargs) == 1:
+            miss_key = next(iter(kwargs.items()))
+            try:
+                if miss_key in self._misses:
+                    raise NoResultFound("No user found matching the criteria")
+            except TypeError:
+                miss_key = None
+
+        # None matches NULL columns, as with filter_by
+        nulls = tuple(key for key in keys if kwargs[key] is None)
+
         # Attempt to filter and return
         # the first user matching the criteria
         try:
-            user = self._session.query(User).filter_by(**kwargs).first()
+            result = self._session.execute(
+                self._user_statement(keys, columns, nulls),
+                {key: value for key, value in kwargs.items()
+                 if value is not None})
+            user = result.first() if columns else result.scalars().first()
             if user is None:
+                if miss_key is not None:
+                    self._misses.add(miss_key, generation)
                 raise NoResultFound("No user found matching the criteria")
             return user
         except NoResultFound as e:
@@ -92,8 +517,9 @@ class DB:
             raise InvalidRequestError(f"Error executing query: {e}")
 
     def update_user(self, user_id: int, **kwargs) -> None:
-        """Updates a user's attributes and commits the changes
-        to the database.
+        """Updates a user's attributes with a single UPDATE statement
+        and commits the changes to the database. Users already loaded
+        in the session are updated in place.
         Args:
             user_id (int): The ID of the user to update.
             kwargs: Arbitrary keyword arguments representing
@@ -105,16 +531,203 @@ class DB:
         Raises:
             ValueError: If a keyword argument
             does not correspond to a valid User attribute.
+            NoResultFound: If no user has the given ID.
         """
-        # Find the user by user_id
-        user = self.find_user_by(id=user_id)
-
-        # Loop through the keyword arguments and update
-        # the user attributes
-        for key, value in kwargs.items():
-            if hasattr(user, key):
-                setattr(user, key, value)
-            else:
+        for key in kwargs:
+            if key not in USER_COLUMNS:
                 raise ValueError(f"Invalid attribute: {key}")
+        if not kwargs:
+            return None
+
+        # Update the row without loading it first
+        result = self._session.execute(
+            update(User).where(User.id == user_id).values(**kwargs))
+        if result.rowcount == 0:
+            raise NoResultFound("No user found matching the criteria")
         # Commit the changes to the database
-        self._session.commit()
+        self._commit()
+        self._forget_misses(**kwargs)
+
+    def _forget_misses(self, **kwargs) -> None:
+        """Drops cached misses that the given column values now match,
+        once they are committed.
+        """
+        self.after_commit(partial(self._discard_misses, kwargs.items()))
+
+    def _discard_misses(self, items: Iterable[tuple]) -> None:
+        """Drops the given cached misses.
+        """
+        for item in items:
+            try:
+                self._misses.discard(item)
+            except TypeError:
+                pass
+
+    def add_session(self, user_id: int, session_id: str,
+                    expires_at: datetime = None) -> UserSession:
+        """Adds a session for a user to the db.
+
+        Args:
+            user_id (int): The ID of the user logging in.
+            session_id (str): The new session ID.
+            expires_at (datetime): When the session stops being valid,
+            None for never.
+
+        Returns:
+            UserSession: The session created.
+        """
+        now = utcnow()
+        user_session = UserSession(id=session_id, user_id=user_id,
+                                   created_at=now, last_seen_at=now,
+                                   expires_at=expires_at)
+        self._session.add(user_session)
+        self._commit()
+        self.after_commit(
+            partial(self._misses.discard, ("session", session_id)))
+        return user_session
+
+    def find_session_user(self, session_id: str) -> Row:
+        """Finds the user owning an unexpired session, in a single
+        primary key lookup joined to the users table.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            Row: The user's `id` and `email`, and the session's
+            `expires_at`.
+
+        Raises:
+            NoResultFound: If the session does not exist or expired.
+        """
+        if ("session", session_id) in self._misses:
+            raise NoResultFound("No session found")
+        generation = self._misses.generation
+        now = utcnow()
+        query = select(User.id, User.email, UserSession.expires_at,
+                       UserSession.last_seen_at).join(
+            UserSession, UserSession.user_id == User.id
+        ).where(
+            UserSession.id == session_id,
+            or_(UserSession.expires_at.is_(None),
+                UserSession.expires_at > now))
+        row = self._session.execute(query).first()
+        if row is None:
+            self._misses.add(("session", session_id), generation)
+            raise NoResultFound("No session found")
+        if now - row.last_seen_at >= LAST_SEEN_RESOLUTION:
+            self._session.execute(
+                update(UserSession).where(UserSession.id == session_id)
+                .values(last_seen_at=now))
+            self._commit()
+        return row
+
+    def delete_sessions(self, user_id: int, session_id: str = None) -> int:
+        """Deletes one session of a user, or all of them.
+
+        Args:
+            user_id (int): The ID of the user.
+            session_id (str): The session to delete, None for every
+            session of the user.
+
+        Returns:
+            int: The number of sessions deleted.
+        """
+        statement = delete(UserSession).where(UserSession.user_id == user_id)
+        if session_id is not None:
+            statement = statement.where(UserSession.id == session_id)
+        deleted = self._session.execute(statement).rowcount
+        self._commit()
+        return deleted
+
+    def purge_expired_sessions(self) -> int:
+        """Deletes every expired session in one statement.
+
+        Returns:
+            int: The number of sessions deleted.
+        """
+        deleted = self._session.execute(
+            delete(UserSession).where(UserSession.expires_at <= utcnow())
+        ).rowcount
+        self._commit()
+        return deleted
+
+    def add_reset_token(self, user_id: int, token_hash: str,
+                        expires_at: datetime) -> None:
+        """Stores a reset token hash for a user, replacing the
+        user's previous tokens, in one transaction.
+
+        Args:
+            user_id (int): The ID of the user.
+            token_hash (str): The hash of the token handed to the user.
+            expires_at (datetime): When the token stops being valid.
+        """
+        self._session.execute(
+            delete(ResetToken).where(ResetToken.user_id == user_id))
+        self._session.add(ResetToken(token_hash=token_hash, user_id=user_id,
+                                     created_at=utcnow(),
+                                     expires_at=expires_at))
+        self._commit()
+
+    def find_reset_token_user(self, token_hash: str) -> int:
+        """Finds the user of an unexpired reset token, in one primary
+        key lookup that leaves the token in place.
+
+        Args:
+            token_hash (str): The hash of the token presented.
+
+        Returns:
+            int: The ID of the user the token was issued to.
+
+        Raises:
+            NoResultFound: If the token is unknown, expired or used.
+        """
+        user_id = self._session.execute(
+            select(ResetToken.user_id).where(
+                ResetToken.token_hash == token_hash,
+                ResetToken.expires_at > utcnow())
+        ).scalar()
+        if user_id is None:
+            raise NoResultFound("No reset token found")
+        return user_id
+
+    def consume_reset_token(self, token_hash: str, **changes) -> int:
+        """Deletes an unexpired reset token and returns its user.
+        A token can only be consumed once.
+
+        Args:
+            token_hash (str): The hash of the token presented.
+            changes: Attribute values applied to the user in the same
+            transaction as the deletion, e.g. hashed_password.
+
+        Returns:
+            int: The ID of the user the token was issued to.
+
+        Raises:
+            NoResultFound: If the token is unknown, expired or used.
+        """
+        user_id = self.find_reset_token_user(token_hash)
+        deleted = self._session.execute(
+            delete(ResetToken).where(ResetToken.token_hash == token_hash)
+        ).rowcount
+        if deleted == 1 and changes:
+            # Commits the deletion along with the changes
+            self.update_user(user_id, **changes)
+        else:
+            self._commit()
+        if deleted != 1:
+            # Consumed concurrently by another request
+            raise NoResultFound("No reset token found")
+        return user_id
+
+    def purge_expired_reset_tokens(self) -> int:
+        """Deletes every expired reset token in one statement.
+
+        Returns:
+            int: The number of tokens deleted.
+        """
+        deleted = self._session.execute(
+            delete(ResetToken).where(ResetToken.expires_at <= utcnow())
+        ).rowcount
+        self._commit()
+        return deleted
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Bulk import of users from a CSV or NDJSON file
+
+Usage:
+    ./import_users.py users.csv
+    ./import_users.py --format ndjson --workers 8 users.jsonl
+
+Each record carries an `email` and either a clear-text `password`,
+hashed in parallel with bcrypt, or an already computed bcrypt
+`hashed_password`, stored as is; a file may mix both, the records with
+a `hashed_password` being imported first. Emails already registered are
+skipped.
+The database is opened in persistent mode so existing users are kept.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from typing import Iterator
+
+from auth import Auth
+from db import DB
+
+
+def read_records(path: str, fmt: str) -> Iterator[dict]:
+    """Yields one dict per user read from a CSV or NDJSON file
+    """
+    with open(path, newline='') as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def check_records(path: str, fmt: str) -> None:
+    """Raises ValueError for the first record lacking an email, or
+    both a password and a hashed_password
+    """
+    for number, record in enumerate(read_records(path, fmt), 1):
+        if not record.get("email"):
+            raise ValueError("record {}: email missing".format(number))
+        if not (record.get("hashed_password") or record.get("password")):
+            raise ValueError("record {}: password or hashed_password "
+                             "missing".format(number))
+
+
+def select_records(path: str, fmt: str, hashed: bool) -> Iterator[dict]:
+    """Yields the records carrying a `hashed_password` if `hashed` is
+    set, the records carrying only a `password` otherwise
+    """
+    for record in read_records(path, fmt):
+        if bool(record.get("hashed_password")) == hashed:
+            yield record
+
+
+def main(argv=None) -> int:
+    """Imports the users and prints how many were created
+    """
+    parser = argparse.ArgumentParser(description="Bulk import users")
+    parser.add_argument("path", help="CSV or NDJSON file to import")
+    parser.add_argument("--format", choices=("csv", "ndjson"),
+                        help="input format, guessed from the extension "
+                             "by default")
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="users per transaction (default: 500)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="password hashing processes "
+                             "(default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "csv" if args.path.lower().endswith(".csv") else "ndjson"
+
+    try:
+        check_records(args.path, fmt)
+    except ValueError as e:
+        print("{}: nothing imported".format(e), file=sys.stderr)
+        return 1
+
+    db = DB(persistent=True)
+    auth = Auth(db)
+
+    start = time.perf_counter()
+    # One pass over the file for each kind of record
+    created = db.add_users(
+        ({"email": r["email"],
+          "hashed_password": r["hashed_password"].encode('utf-8')}
+         for r in select_records(args.path, fmt, hashed=True)),
+        chunk_size=args.chunk_size)
+    created += auth.register_users(
+        ((r["email"], r["password"])
+         for r in select_records(args.path, fmt, hashed=False)),
+        chunk_size=args.chunk_size, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print("{} users imported in {:.1f}s".format(created, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
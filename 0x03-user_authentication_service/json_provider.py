@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Module for encoding the app's JSON with orjson when it is importable,
+the standard library otherwise; JSON_BACKEND=json forces the standard
+library.
+
+Responses keep the output of Flask's default provider: sorted keys,
+compact unless in debug mode and a trailing newline. Datetimes are
+encoded natively as ISO 8601, to the second.
+"""
+
+import json
+from datetime import date, datetime
+from os import getenv
+from flask import Flask
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None and getenv('JSON_BACKEND', 'orjson') != 'json':
+    BACKEND = 'orjson'
+else:
+    BACKEND = 'json'
+
+if orjson is not None:
+    _OPTIONS = (orjson.OPT_OMIT_MICROSECONDS | orjson.OPT_NON_STR_KEYS |
+                orjson.OPT_SORT_KEYS)
+    _INDENTED_OPTIONS = _OPTIONS | orjson.OPT_INDENT_2
+
+
+def _default(value):
+    """Encoding of the values the standard library can't encode."""
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(value).__name__))
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Encodes `obj` as UTF-8 JSON with sorted keys."""
+    if BACKEND == 'orjson':
+        return orjson.dumps(obj, default=_default, option=(
+            _INDENTED_OPTIONS if indent else _OPTIONS))
+    return json.dumps(obj, default=_default, ensure_ascii=False,
+                      sort_keys=True, indent=2 if indent else None,
+                      separators=None if indent else (',', ':')
+                      ).encode('utf-8')
+
+
+def loads(data):
+    """Decodes JSON from bytes or str."""
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CodecJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by dumps and loads.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Encodes `obj`, indented if `indent` is set."""
+        return dumps(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Decodes JSON from bytes or str."""
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        """Response of the JSON of the arguments, as jsonify's."""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            dumps(obj, indent=self._app.debug) + b'\n',
+            mimetype='application/json')
+
+
+def init_app(app: Flask) -> None:
+    """Encodes and decodes the JSON of `app` with this module."""
+    app.json = CodecJSONProvider(app)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Module for accounting memory: approximate bytes held by the mapped
+objects alive, i.e. in SQLAlchemy identity maps, and by the in-process
+caches, and tracemalloc snapshots to diff.
+
+Usage, against a running service, as a user listed in ADMIN_EMAILS:
+    ./memory.py --session-id ID report
+    ./memory.py --session-id ID snapshot
+    ./memory.py --session-id ID diff 1 2
+    ./memory.py --session-id ID stop
+"""
+
+import argparse
+import gc
+import json
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Dict, List, Tuple
+
+# Snapshots kept for diffing, the oldest being dropped first
+MAX_SNAPSHOTS = 10
+
+# Shared by every instance, so never counted
+_SKIPPED = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def deep_size(obj, seen: set = None) -> int:
+    """
+    Approximates the bytes held by `obj` and the objects it refers to,
+    counting each object once across calls sharing `seen`.
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIPPED):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            for key, value in item.items():
+                # ORM bookkeeping refers to the whole session and mapper
+                if not (isinstance(key, str) and key.startswith('_sa_')):
+                    stack.append(key)
+                    stack.append(value)
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+    return total
+
+
+def orm_usage(classes: Tuple[type]) -> Dict[str, dict]:
+    """
+    Finds the instances of mapped `classes` alive in the process,
+    whether held by a session's identity map or anything else.
+    Returns:
+        Dict[str, dict]: the number of instances and their approximate
+        bytes by class name.
+    """
+    instances = {cls: [] for cls in classes}
+    for obj in gc.get_objects():
+        found = instances.get(type(obj))
+        if found is not None:
+            found.append(obj)
+    seen = set()
+    return {cls.__name__: {"objects": len(found),
+                           "bytes": sum(deep_size(obj, seen)
+                                        for obj in found)}
+            for cls, found in instances.items()}
+
+
+def report(auth_service, throttle=None) -> dict:
+    """
+    Accounts the memory of mapped objects, caches and login throttle.
+    Returns:
+        dict: usage of each mapped class, of each cache of
+        `auth_service`, of `throttle` if any, and the state of
+        tracemalloc.
+    """
+    from user import ResetToken, User, UserSession
+    result = {
+        "identity_map": orm_usage((User, UserSession, ResetToken)),
+        "caches": {name: {"objects": len(cache), "bytes": deep_size(cache)}
+                   for name, cache in auth_service.caches().items()},
+    }
+    if throttle is not None:
+        result["login_throttle"] = {
+            "objects": len(throttle.by_ip) + len(throttle.by_email) +
+            len(throttle.signup_by_ip),
+            "bytes": deep_size(throttle)}
+    result["tracemalloc"] = status()
+    return result
+
+
+_snapshots = OrderedDict()
+_last_id = 0
+_lock = threading.Lock()
+
+
+def take_snapshot(frames: int = 1) -> int:
+    """
+    Takes a tracemalloc snapshot, starting to trace if needed:
+    only allocations made since tracing started are seen.
+    Returns:
+        int: the id of the snapshot.
+    """
+    global _last_id
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),))
+    with _lock:
+        _last_id += 1
+        _snapshots[_last_id] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+        return _last_id
+
+
+def diff(first: int, second: int, limit: int = 20) -> List[dict]:
+    """
+    Compares two snapshots by source line.
+    Returns:
+        List[dict]: the `limit` lines whose allocations grew the most.
+    Raises:
+        KeyError: If a snapshot is unknown.
+    """
+    stats = _snapshots[second].compare_to(_snapshots[first], 'lineno')
+    return [{"location": str(stat.traceback),
+             "size_diff": stat.size_diff, "size": stat.size,
+             "count_diff": stat.count_diff, "count": stat.count}
+            for stat in stats[:limit]]
+
+
+def stop() -> None:
+    """Stops tracing and forgets every snapshot."""
+    with _lock:
+        _snapshots.clear()
+    tracemalloc.stop()
+
+
+def status() -> dict:
+    """Whether tracemalloc traces, what it traced and the snapshots."""
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": tracemalloc.is_tracing(), "traced_bytes": current,
+            "peak_traced_bytes": peak, "snapshots": list(_snapshots)}
+
+
+def main() -> None:
+    """Calls the memory admin endpoints of a running service."""
+    import requests
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--session-id", required=True,
+                        help="session of a user listed in ADMIN_EMAILS")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("command",
+                        choices=("report", "snapshot", "diff", "stop"))
+    parser.add_argument("snapshots", nargs="*", type=int,
+                        help="the two snapshots to diff")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + "/admin/memory"
+    cookies = {"session_id": args.session_id}
+    if args.command == "report":
+        response = requests.get(url, cookies=cookies)
+    elif args.command == "snapshot":
+        response = requests.post(url + "/snapshots", cookies=cookies)
+    elif args.command == "stop":
+        response = requests.delete(url + "/snapshots", cookies=cookies)
+    else:
+        if len(args.snapshots) != 2:
+            parser.error("diff needs two snapshot ids")
+        response = requests.get(
+            url + "/snapshots/{}/diff/{}".format(*args.snapshots),
+            params={"limit": args.limit}, cookies=cookies)
+    if not response.ok:
+        sys.exit("{} {}".format(response.status_code, response.text))
+    json.dump(response.json(), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Module for collecting metrics in the Prometheus text format.
+
+Requests are counted into lock-free histograms by route and status;
+everything else is read when /metrics is scraped.
+"""
+
+import os
+from time import perf_counter_ns
+from typing import Dict, List
+from flask import Flask, g, request
+from timing import Histogram
+import auth
+
+# (method, route, status) -> Histogram of request durations
+REQUESTS = {}
+
+# Durations of password hashes
+PASSWORD_HASHES = Histogram()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def start_request() -> None:
+    """Notes when the current request started."""
+    g.metrics_start = perf_counter_ns()
+
+
+def finish_request(response):
+    """Counts the current request by route and status."""
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    # Unmatched paths share one route, so that labels stay bounded
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    key = (request.method, rule, str(response.status_code))
+    histogram = REQUESTS.get(key)
+    if histogram is None:
+        histogram = REQUESTS.setdefault(key, Histogram())
+    histogram.observe((perf_counter_ns() - start) / 1e9)
+    return response
+
+
+def _record_hash(duration: int) -> None:
+    """Counts the duration of a password hash."""
+    PASSWORD_HASHES.observe(duration / 1e9)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    """Formats labels as {name="value",...}."""
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items()) + '}'
+
+
+def _family(lines: List[str], name: str, kind: str, text: str) -> None:
+    """Starts a metric family."""
+    lines.append('# HELP {} {}'.format(name, text))
+    lines.append('# TYPE {} {}'.format(name, kind))
+
+
+def _histogram(lines: List[str], name: str, labels: Dict[str, str],
+               histogram: Histogram) -> None:
+    """Writes the samples of one histogram, with cumulative buckets."""
+    snapshot = histogram.snapshot()
+    cumulated = 0
+    bounds = [repr(bound) for bound in snapshot['buckets']] + ['+Inf']
+    for bound, count in zip(bounds, snapshot['counts']):
+        cumulated += count
+        lines.append('{}_bucket{} {}'.format(
+            name, _labels(dict(labels, le=bound)), cumulated))
+    lines.append('{}_sum{} {!r}'.format(name, _labels(labels),
+                                        snapshot['sum']))
+    lines.append('{}_count{} {}'.format(name, _labels(labels),
+                                        snapshot['count']))
+
+
+def render(auth_service: auth.Auth, throttle=None) -> str:
+    """
+    Collects every metric.
+    Returns:
+        str: the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    requests = sorted(tuple(REQUESTS.items()))
+
+    _family(lines, 'http_requests_total', 'counter',
+            'Requests served, by route and status.')
+    for (method, route, status), histogram in requests:
+        lines.append('http_requests_total{} {}'.format(
+            _labels({'method': method, 'route': route, 'status': status}),
+            histogram.snapshot()['count']))
+
+    _family(lines, 'http_request_duration_seconds', 'histogram',
+            'Request latency, by route and status.')
+    for (method, route, status), histogram in requests:
+        _histogram(lines, 'http_request_duration_seconds',
+                   {'method': method, 'route': route, 'status': status},
+                   histogram)
+
+    storage = auth_service.storage_stats()
+    _family(lines, 'model_objects', 'gauge', 'Rows of each table.')
+    for table, count in sorted(storage['rows'].items()):
+        lines.append('model_objects{} {}'.format(
+            _labels({'model': table}), count))
+
+    _family(lines, 'model_store_bytes', 'gauge',
+            'Size of each database file.')
+    for file_path, size in sorted(storage['file_sizes'].items()):
+        lines.append('model_store_bytes{} {}'.format(
+            _labels({'file': os.path.basename(file_path)}), size))
+
+    if storage['last_commit_seconds'] is not None:
+        _family(lines, 'model_last_flush_seconds', 'gauge',
+                'Duration of the last commit that wrote something.')
+        lines.append('model_last_flush_seconds {!r}'.format(
+            storage['last_commit_seconds']))
+
+    _family(lines, 'password_hash_duration_seconds', 'histogram',
+            'Duration of password hashes.')
+    _histogram(lines, 'password_hash_duration_seconds', {},
+               PASSWORD_HASHES)
+
+    _family(lines, 'auth_sessions', 'gauge', 'Sessions not expired.')
+    lines.append('auth_sessions {}'.format(storage['active_sessions']))
+
+    cache = auth_service.session_cache_stats()
+    _family(lines, 'session_cache_lookups_total', 'counter',
+            'Session lookups served from memory or not.')
+    for result in ('hits', 'misses'):
+        lines.append('session_cache_lookups_total{} {}'.format(
+            _labels({'result': result}), cache[result]))
+
+    if throttle is not None:
+        _family(lines, 'login_throttled_total', 'counter',
+                'Login and signup attempts rejected, by limiter.')
+        for limiter, count in sorted(throttle.rejections.items()):
+            lines.append('login_throttled_total{} {}'.format(
+                _labels({'limiter': limiter}), count))
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app: Flask) -> None:
+    """Counts the requests of `app` and its password hash timings."""
+    if _record_hash not in auth.HASH_LISTENERS:
+        auth.HASH_LISTENERS.append(_record_hash)
+    # Run before and after every other hook, so that they are counted
+    app.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    app.after_request_funcs.setdefault(None, []).insert(0, finish_request)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Regression tests of the unit of work wrapping each request"""
+import os
+import tempfile
+
+# Never touch a.db: the app recreates its database when imported
+os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(),
+                                                   "test.db")
+
+from app import AUTH, app  # noqa: E402
+
+
+@app.route('/test/crash', methods=['POST'])
+def crash():
+    """Writes a user, then fails."""
+    AUTH._db.add_user('crash@example.com', 'hashed')
+    raise RuntimeError('crash after a write')
+
+
+def registered(email: str) -> bool:
+    """Whether a user with `email` is committed."""
+    try:
+        return bool(AUTH._db.existing_emails((email,)))
+    finally:
+        AUTH._db.remove_session()
+
+
+def test_failed_request_is_rolled_back() -> None:
+    """Writes flushed before an unhandled exception are not committed."""
+    response = app.test_client().post('/test/crash')
+    assert response.status_code == 500
+    assert not registered('crash@example.com')
+
+
+def test_successful_request_is_committed() -> None:
+    """Writes of a successful request are committed."""
+    response = app.test_client().post(
+        '/users', data={'email': 'ok@example.com', 'password': 'pw'})
+    assert response.status_code == 200
+    assert registered('ok@example.com')
+
+
+if __name__ == "__main__":
+    test_failed_request_is_rolled_back()
+    test_successful_request_is_committed()
+    print("OK")
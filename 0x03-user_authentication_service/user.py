@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 """
-SQLAlchemy model for the users table.
+SQLAlchemy models for the users, sessions and reset_tokens tables.
 """
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 
 # Declare a base class for our models
@@ -18,10 +18,17 @@ class User(Base):
         id (int): The primary key of the user.
         email (str): The email of the user
         hashed_password (str):hashed password of the user.
-        session_id (str): Nullable session ID for user sessions.
-        reset_token (str): Nullable reset token for password resets.
+        session_id (str): Nullable session ID, superseded by the
+        sessions table which allows several sessions per user.
+        reset_token (str): Nullable reset token, superseded by the
+        reset_tokens table which stores hashed, expiring tokens.
     """
     __tablename__ = 'users'
+    __table_args__ = (
+        Index('ix_users_email', 'email', unique=True),
+        Index('ix_users_session_id', 'session_id', unique=True),
+        Index('ix_users_reset_token', 'reset_token', unique=True),
+    )
 
     id = Column(Integer, primary_key=True, nullable=False)
     email = Column(String(250), nullable=False)
@@ -34,3 +41,55 @@ class User(Base):
         String representation of the User instance.
         """
         return f"<User(id={self.id}, email={self.email})>"
+
+
+class UserSession(Base):
+    """
+    sessions table model, one row per logged in device
+
+    Attributes:
+        id (str): The session ID, primary key.
+        user_id (int): The user the session belongs to.
+        created_at (datetime): When the session was created.
+        last_seen_at (datetime): When the session was last used.
+        expires_at (datetime): Nullable expiry, None never expires.
+    """
+    __tablename__ = 'sessions'
+
+    id = Column(String(250), primary_key=True, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'),
+                     nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    last_seen_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=True, index=True)
+
+    def __repr__(self):
+        """
+        String representation of the UserSession instance.
+        """
+        return f"<UserSession(id={self.id}, user_id={self.user_id})>"
+
+
+class ResetToken(Base):
+    """
+    reset_tokens table model, one row per pending password reset
+
+    Attributes:
+        token_hash (str): SHA-256 hex digest of the token, primary key.
+        user_id (int): The user the token lets reset their password.
+        created_at (datetime): When the token was issued.
+        expires_at (datetime): When the token stops being valid.
+    """
+    __tablename__ = 'reset_tokens'
+
+    token_hash = Column(String(64), primary_key=True, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'),
+                     nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        """
+        String representation of the ResetToken instance.
+        """
+        return f"<ResetToken(user_id={self.user_id})>"
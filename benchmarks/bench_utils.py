@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the benchmark scripts: timing, percentiles,
+environment metadata and machine-readable results.
+"""
+
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def project_path(name: str) -> str:
+    """Absolute path of one of the repository's projects."""
+    return os.path.join(ROOT, name)
+
+
+def timed(fn: Callable, samples: int, budget: float = 10.0,
+          minimum: int = 3) -> List[int]:
+    """
+    Calls `fn` up to `samples` times and returns each call's duration
+    in nanoseconds. Stops early once `budget` seconds are spent, after
+    at least `minimum` calls, so that slow operations stay affordable
+    on large data sets.
+    """
+    durations = []
+    deadline = time.perf_counter() + budget
+    for _ in range(samples):
+        start = time.perf_counter_ns()
+        fn()
+        durations.append(time.perf_counter_ns() - start)
+        if len(durations) >= minimum and time.perf_counter() > deadline:
+            break
+    return durations
+
+
+def summarize(durations_ns: List[int]) -> dict:
+    """
+    Latency percentiles in microseconds and throughput in operations
+    per second for a list of durations in nanoseconds.
+    """
+    ordered = sorted(durations_ns)
+    count = len(ordered)
+
+    def pct(p):
+        return ordered[min(count - 1, int(p / 100 * count))] / 1000
+
+    mean = sum(ordered) / count
+    return {
+        "samples": count,
+        "p50_us": pct(50),
+        "p95_us": pct(95),
+        "p99_us": pct(99),
+        "max_us": ordered[-1] / 1000,
+        "mean_us": mean / 1000,
+        "ops_per_sec": 1e9 / mean if mean else None,
+    }
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the current process."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def environment() -> dict:
+    """Metadata identifying the machine and the commit measured."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path: str, suite: str, results: List[dict]) -> None:
+    """Writes a suite's results with environment metadata as JSON."""
+    with open(path, "w") as f:
+        json.dump({"suite": suite, "environment": environment(),
+                   "results": results}, f, indent=2)
+        f.write("\n")
+
+
+def result_key(result: dict) -> tuple:
+    """Identifies a result across runs: every field but the measures."""
+    return tuple(sorted((k, v) for k, v in result.items()
+                        if not isinstance(v, (int, float)) or k == "size"))
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Prints the p50 and throughput change between two result files."""
+    with open(old_path) as f:
+        old = {result_key(r): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print("{:<60} {:>12} {:>12} {:>8}".format(
+        "benchmark", "old p50 us", "new p50 us", "change"))
+    for result in new:
+        before = old.get(result_key(result))
+        if before is None or "p50_us" not in result:
+            continue
+        name = " ".join(str(v) for k, v in result_key(result))
+        change = (result["p50_us"] - before["p50_us"]) / before["p50_us"]
+        print("{:<60} {:>12.1f} {:>12.1f} {:>+7.0%}".format(
+            name[:60], before["p50_us"], result["p50_us"], change))
+
+
+def print_table(results: List[dict]) -> None:
+    """Prints results as a human readable table."""
+    print("{:<8} {:>9} {:<38} {:>7} {:>11} {:>11} {:>11} {:>12}".format(
+        "layer", "size", "operation", "samples", "p50 us", "p95 us",
+        "p99 us", "ops/s"))
+    for r in results:
+        operation = r["operation"]
+        if "json_backend" in r:
+            operation += " ({})".format(r["json_backend"])
+        print("{:<8} {:>9} {:<38} {:>7} {:>11.1f} {:>11.1f} {:>11.1f} "
+              "{:>12.1f}".format(r["layer"], r["size"], operation,
+                                 r["samples"], r["p50_us"], r["p95_us"],
+                                 r["p99_us"], r["ops_per_sec"] or 0))
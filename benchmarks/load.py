@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Concurrent HTTP load harness for the three authentication APIs.
+
+Usage:
+    python3 benchmarks/load.py                        # every target
+    python3 benchmarks/load.py --targets 0x03 --concurrency 8 \\
+        --duration 30 --mix signup=1,browse=8,reset=1
+    python3 benchmarks/load.py --targets 0x03 --url http://127.0.0.1:5000
+
+Worker threads repeatedly pick a flow by weight and run it, timing every
+request. The 0x03 flows are those of 0x03's main.py end-to-end test;
+0x01 drives the Basic-auth API and 0x02 the session-auth API. Apps are
+driven in-process through Flask's test client, each target in its own
+process and temporary directory. With --url, the 0x03 flows run against
+a live server instead. The report gives requests per second, p50/p95/p99
+latency and unexpected statuses per endpoint, as a table and as JSON.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict
+
+import bench_utils
+from bench_utils import summarize
+
+TARGETS = {
+    "0x01": "0x01-Basic_authentication",
+    "0x02": "0x02-Session_authentication",
+    "0x03": "0x03-user_authentication_service",
+}
+
+PASSWORD = "b4l0u"
+NEW_PASSWORD = "t4rt1fl3tt3"
+
+# Load comes from a single address: keep login and signup throttling
+# out of the way
+THROTTLE_ENV = {
+    "LOGIN_IP_BURST": "1000000000",
+    "LOGIN_IP_RATE": "1000000000",
+    "LOGIN_EMAIL_BURST": "1000000000",
+    "LOGIN_EMAIL_RATE": "1000000000",
+    "SIGNUP_IP_BURST": "1000000000",
+    "SIGNUP_IP_RATE": "1000000000",
+}
+
+
+class TestClientDriver:
+    """Sends requests to an app in-process, keeping cookies."""
+
+    def __init__(self, app):
+        """Wraps a fresh test client of `app`."""
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, **kwargs):
+        """Returns the status code and JSON body of a request."""
+        response = self.client.open(path, method=method, **kwargs)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPDriver:
+    """Sends requests to a live server, keeping cookies."""
+
+    def __init__(self, url: str):
+        """Opens a requests session on `url`."""
+        import requests
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, **kwargs):
+        """Returns the status code and JSON body of a request."""
+        response = self.session.request(method, self.url + path,
+                                        allow_redirects=False, **kwargs)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class Worker:
+    """State of one load thread: its driver, user and measures."""
+
+    def __init__(self, driver, index: int, recorder: "Recorder"):
+        """Initializes a worker owning its own test user."""
+        self.driver = driver
+        self.index = index
+        self.recorder = recorder
+        self.email = "load{}-{}@example.com".format(os.getpid(), index)
+        self.password = PASSWORD
+        self.user_id = None
+        self.counter = 0
+
+    def call(self, endpoint: str, expect: int, method: str, path: str,
+             **kwargs):
+        """Times one request, recorded under `endpoint`."""
+        start = time.perf_counter_ns()
+        status, body = self.driver.request(method, path, **kwargs)
+        self.recorder.record(endpoint, time.perf_counter_ns() - start,
+                             status != expect)
+        return status, body
+
+
+class Recorder:
+    """Collects request durations per endpoint without locking."""
+
+    def __init__(self):
+        """Initializes empty per-thread buffers."""
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+        self.enabled = False
+
+    def record(self, endpoint: str, duration_ns: int, error: bool) -> None:
+        """Records one request of the current thread."""
+        if not self.enabled:
+            return
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = defaultdict(lambda: ([], [0]))
+            with self._lock:
+                self._buffers.append(buffer)
+        durations, errors = buffer[endpoint]
+        durations.append(duration_ns)
+        errors[0] += error
+
+    def merged(self) -> Dict[str, tuple]:
+        """Durations and error counts of every thread, per endpoint."""
+        merged = defaultdict(lambda: ([], 0))
+        for buffer in self._buffers:
+            for endpoint, (durations, errors) in buffer.items():
+                total, count = merged[endpoint]
+                total.extend(durations)
+                merged[endpoint] = (total, count + errors[0])
+        return merged
+
+
+# 0x03: flows of main.py
+
+
+def setup_0x03(w: Worker) -> None:
+    """Registers the worker's user."""
+    w.call("POST /users", 200, "POST", "/users",
+           data={"email": w.email, "password": w.password})
+
+
+def flow_0x03_signup(w: Worker) -> None:
+    """Registers a new user, then logs in and out as in main.py."""
+    w.counter += 1
+    email = "signup{}-{}-{}@example.com".format(os.getpid(), w.index,
+                                                w.counter)
+    w.call("POST /users", 200, "POST", "/users",
+           data={"email": email, "password": PASSWORD})
+    w.call("POST /sessions", 401, "POST", "/sessions",
+           data={"email": email, "password": NEW_PASSWORD})
+    w.call("GET /profile", 403, "GET", "/profile")
+    w.call("POST /sessions", 200, "POST", "/sessions",
+           data={"email": email, "password": PASSWORD})
+    w.call("GET /profile", 200, "GET", "/profile")
+    w.call("DELETE /sessions", 302, "DELETE", "/sessions")
+
+
+def flow_0x03_browse(w: Worker) -> None:
+    """Logs in, reads the profile a few times and logs out."""
+    w.call("POST /sessions", 200, "POST", "/sessions",
+           data={"email": w.email, "password": w.password})
+    for _ in range(5):
+        w.call("GET /profile", 200, "GET", "/profile")
+    w.call("DELETE /sessions", 302, "DELETE", "/sessions")
+
+
+def flow_0x03_reset(w: Worker) -> None:
+    """Resets the password with a token and logs in with the new one."""
+    status, body = w.call("POST /reset_password", 200, "POST",
+                          "/reset_password", data={"email": w.email})
+    if status != 200:
+        return
+    new_password = NEW_PASSWORD if w.password == PASSWORD else PASSWORD
+    w.call("PUT /reset_password", 200, "PUT", "/reset_password",
+           data={"email": w.email, "reset_token": body["reset_token"],
+                 "new_password": new_password})
+    w.password = new_password
+    w.call("POST /sessions", 200, "POST", "/sessions",
+           data={"email": w.email, "password": w.password})
+
+
+# 0x01: Basic authentication
+
+
+def basic_header(email: str, password: str) -> dict:
+    """Authorization header for Basic authentication."""
+    token = base64.b64encode("{}:{}".format(email, password).encode())
+    return {"Authorization": "Basic " + token.decode()}
+
+
+def seed_models_user(w: Worker) -> None:
+    """Creates the worker's user directly in the models store."""
+    from models.user import User
+    user = User(email=w.email)
+    user.password = w.password
+    user.save()
+    w.user_id = user.id
+
+
+def flow_0x01_read(w: Worker) -> None:
+    """Reads the users list and one user with Basic credentials."""
+    headers = basic_header(w.email, w.password)
+    w.call("GET /api/v1/users", 200, "GET", "/api/v1/users",
+           headers=headers)
+    w.call("GET /api/v1/users/:id", 200, "GET",
+           "/api/v1/users/" + w.user_id, headers=headers)
+
+
+def flow_0x01_denied(w: Worker) -> None:
+    """Requests without and with wrong credentials."""
+    w.call("GET /api/v1/users (401)", 401, "GET", "/api/v1/users")
+    w.call("GET /api/v1/users (403)", 403, "GET", "/api/v1/users",
+           headers=basic_header(w.email, "wrong"))
+
+
+def flow_status(w: Worker) -> None:
+    """Unauthenticated status check."""
+    w.call("GET /api/v1/status", 200, "GET", "/api/v1/status")
+
+
+# 0x02: session authentication
+
+
+def flow_0x02_session(w: Worker) -> None:
+    """Logs in, reads its own profile and the users list, logs out."""
+    w.call("POST /api/v1/auth_session/login", 200, "POST",
+           "/api/v1/auth_session/login",
+           data={"email": w.email, "password": w.password})
+    for _ in range(5):
+        w.call("GET /api/v1/users/me", 200, "GET", "/api/v1/users/me")
+    w.call("GET /api/v1/users", 200, "GET", "/api/v1/users")
+    w.call("DELETE /api/v1/auth_session/logout", 200, "DELETE",
+           "/api/v1/auth_session/logout")
+
+
+FLOWS = {
+    "0x01": {"read": flow_0x01_read, "denied": flow_0x01_denied,
+             "status": flow_status},
+    "0x02": {"session": flow_0x02_session, "status": flow_status},
+    "0x03": {"signup": flow_0x03_signup, "browse": flow_0x03_browse,
+             "reset": flow_0x03_reset},
+}
+DEFAULT_MIX = {
+    "0x01": "read=8,denied=1,status=1",
+    "0x02": "session=9,status=1",
+    "0x03": "signup=1,browse=8,reset=1",
+}
+SETUP = {"0x01": seed_models_user, "0x02": seed_models_user,
+         "0x03": setup_0x03}
+ENV = {
+    "0x01": {"AUTH_TYPE": "basic_auth"},
+    "0x02": {"AUTH_TYPE": "session_auth",
+             "SESSION_NAME": "_my_session_id"},
+    "0x03": {},
+}
+
+
+def load_app(target: str):
+    """Imports the Flask app of `target` from the current directory."""
+    os.environ.update(ENV[target])
+    for name, value in THROTTLE_ENV.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, bench_utils.project_path(TARGETS[target]))
+    if target == "0x03":
+        from app import app
+    else:
+        from api.v1.app import app
+    return app
+
+
+def parse_mix(mix: str, flows: Dict[str, Callable]) -> Dict[str, float]:
+    """Parses `name=weight,...` into weights of known flows."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in flows:
+            raise SystemExit("unknown flow {!r}, expected one of {}".format(
+                name, ", ".join(flows)))
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def run(target: str, concurrency: int, duration: float, warmup: float,
+        mix: str, url: str = None) -> list:
+    """Runs the load on one target and returns one result per endpoint."""
+    flows = FLOWS[target]
+    weights = parse_mix(mix or DEFAULT_MIX[target], flows)
+    app = None if url else load_app(target)
+    recorder = Recorder()
+
+    workers = []
+    for index in range(concurrency):
+        driver = HTTPDriver(url) if url else TestClientDriver(app)
+        worker = Worker(driver, index, recorder)
+        SETUP[target](worker)
+        workers.append(worker)
+
+    stop = threading.Event()
+    names, values = list(weights), list(weights.values())
+
+    def loop(worker):
+        rnd = random.Random(worker.index)
+        while not stop.is_set():
+            flows[rnd.choices(names, values)[0]](worker)
+
+    threads = [threading.Thread(target=loop, args=(w,)) for w in workers]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    recorder.enabled = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    recorder.enabled = False
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    results = []
+    for endpoint, (durations, errors) in sorted(recorder.merged().items()):
+        result = dict(target=target, endpoint=endpoint,
+                      concurrency=concurrency, **summarize(durations))
+        result["requests_per_sec"] = len(durations) / elapsed
+        result["unexpected_status"] = errors
+        results.append(result)
+    return results
+
+
+def print_report(results: list) -> None:
+    """Prints results as a human readable table."""
+    print("{:<6} {:<36} {:>8} {:>9} {:>10} {:>10} {:>10} {:>6}".format(
+        "target", "endpoint", "requests", "req/s", "p50 ms", "p95 ms",
+        "p99 ms", "errors"))
+    for r in results:
+        print("{:<6} {:<36} {:>8} {:>9.1f} {:>10.2f} {:>10.2f} {:>10.2f} "
+              "{:>6}".format(r["target"], r["endpoint"], r["samples"],
+                             r["requests_per_sec"], r["p50_us"] / 1000,
+                             r["p95_us"] / 1000, r["p99_us"] / 1000,
+                             r["unexpected_status"]))
+
+
+def main() -> None:
+    """Runs the load on every requested target."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS),
+                        default=sorted(TARGETS))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds measured per target")
+    parser.add_argument("--warmup", type=float, default=1.0,
+                        help="seconds run before measuring")
+    parser.add_argument("--mix", help="flow weights, e.g. "
+                        "signup=1,browse=8,reset=1; one target only")
+    parser.add_argument("--url", help="live 0x03 server to load instead "
+                        "of the in-process app")
+    parser.add_argument("--output", default="load-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files and exit")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        bench_utils.compare(*args.compare)
+        return
+    if args.url and args.targets != ["0x03"]:
+        parser.error("--url only supports --targets 0x03")
+    if args.mix and len(args.targets) != 1:
+        parser.error("--mix needs a single target")
+    if args.worker:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            results = run(args.worker, args.concurrency, args.duration,
+                          args.warmup, args.mix, args.url)
+        json.dump(results, sys.stdout)
+        return
+
+    results = []
+    for target in args.targets:
+        print("loading {}...".format(target), file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--worker", target, "--targets", target,
+                   "--concurrency", str(args.concurrency),
+                   "--duration", str(args.duration),
+                   "--warmup", str(args.warmup)]
+        if args.mix:
+            command += ["--mix", args.mix]
+        if args.url:
+            command += ["--url", args.url]
+        output = subprocess.run(command, check=True, capture_output=True,
+                                text=True).stdout
+        results.extend(json.loads(output))
+    bench_utils.write_results(args.output, "load", results)
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
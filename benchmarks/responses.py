@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Response benchmarks for GET /api/v1/users on large lists.
+
+Usage:
+    python3 benchmarks/responses.py                   # 1k, 10k, 100k
+    python3 benchmarks/responses.py --sizes 10000 --levels 1 6
+    python3 benchmarks/responses.py --json-backends json
+    python3 benchmarks/responses.py --compare old.json new.json
+
+Each size runs in its own process on synthetic users of the
+0x02-Session_authentication app, served through Flask's test client
+with no authentication, so that only building, serializing and
+compressing the list is measured. The list is fetched without
+compression, with gzip at each level and with ?fields=id,email, once
+per JSON_BACKEND; the bytes sent are recorded with the latencies.
+Nothing needs network access.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+import bench_utils
+from bench_utils import summarize, timed
+
+PROJECT = "0x02-Session_authentication"
+
+# Stored as is, so that no hashing cost is measured while populating
+SHA256_HASH = ("5e884898da28047151d0e56f8dc62927"
+               "73603d0d6aabbdd62a11ef721d1542d8")
+
+
+def bench_users(size: int, levels: List[int], samples: int,
+                budget: float) -> List[dict]:
+    """Benchmarks listing `size` users."""
+    sys.path.insert(0, bench_utils.project_path(PROJECT))
+    from models.base import DATA
+    from models.json_codec import BACKEND
+    from models.user import User
+    from api.v1.app import create_app
+
+    User.load_from_file()
+    users = DATA["User"]
+    for i in range(size):
+        user = User(email="user{}@example.com".format(i),
+                    first_name="First{}".format(i),
+                    last_name="Last{}".format(i), _password=SHA256_HASH)
+        users[user.id] = user
+    User.save_to_file()
+
+    app = create_app(auth_type="", warm=False)
+    client = app.test_client()
+    compressor = app.extensions["compression"]
+    results = []
+
+    def fetch(path="/api/v1/users", **headers):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 200, response.status_code
+        return response.get_data()
+
+    for level in [0] + levels:
+        compressor.level = level
+        headers = {"Accept-Encoding": "gzip"} if level else {}
+        body_bytes = len(fetch(**headers))
+        results.append(dict(
+            layer="users", size=size, json_backend=BACKEND,
+            operation="list_gzip_{}".format(level) if level else "list",
+            **summarize(timed(lambda: fetch(**headers), samples, budget)),
+            body_bytes=body_bytes))
+
+    compressor.level = 0
+    path = "/api/v1/users?fields=id,email"
+    results.append(dict(
+        layer="users", size=size, json_backend=BACKEND,
+        operation="list_fields_id_email",
+        **summarize(timed(lambda: fetch(path), samples, budget)),
+        body_bytes=len(fetch(path))))
+    return results
+
+
+def worker(size: int, levels: List[int], samples: int,
+           budget: float) -> None:
+    """Runs the benchmark of one size and prints its results."""
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = bench_users(size, levels, samples, budget)
+    rss = bench_utils.peak_rss_bytes()
+    for result in results:
+        result["peak_rss_bytes"] = rss
+    json.dump(results, sys.stdout)
+
+
+def main() -> None:
+    """Runs every requested benchmark in a child process."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9],
+                        help="gzip levels measured besides no compression")
+    parser.add_argument("--samples", type=int, default=200,
+                        help="maximum samples per operation")
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="seconds spent at most per operation, "
+                             "after 3 samples")
+    parser.add_argument("--json-backends", nargs="+",
+                        choices=["orjson", "json"], default=["orjson", "json"],
+                        help="JSON_BACKEND of each run")
+    parser.add_argument("--output", default="responses-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files and exit")
+    parser.add_argument("--worker", type=int, metavar="SIZE",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        bench_utils.compare(*args.compare)
+        return
+    if args.worker is not None:
+        worker(args.worker, args.levels, args.samples, args.budget)
+        return
+
+    results = []
+    for backend, size in [(b, s) for b in args.json_backends
+                          for s in args.sizes]:
+        print("running users with {} records and {}...".format(
+            size, backend), file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             "--worker", str(size),
+             "--levels"] + [str(level) for level in args.levels] +
+            ["--samples", str(args.samples), "--budget", str(args.budget)],
+            check=True, capture_output=True, text=True,
+            env=dict(os.environ, JSON_BACKEND=backend)).stdout
+        results.extend(json.loads(output))
+    bench_utils.write_results(args.output, "responses", results)
+    bench_utils.print_table(results)
+    for result in results:
+        print("{:<8} {:>9} {:<28} {:<7} {:>12} bytes".format(
+            result["layer"], result["size"], result["operation"],
+            result["json_backend"], result["body_bytes"]))
+
+
+if __name__ == "__main__":
+    main()
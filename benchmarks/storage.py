@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Storage benchmarks for the models.base file store and the 0x03 DB class.
+
+Usage:
+    python3 benchmarks/storage.py                     # 10k, 100k, 1M
+    python3 benchmarks/storage.py --sizes 10000 --layers base
+    python3 benchmarks/storage.py --compare old.json new.json
+    python3 benchmarks/storage.py --json-backends orjson json
+
+Each (layer, size) pair runs in its own process on synthetic users and
+sessions in a temporary directory, so peak RSS and file sizes belong to
+that data set alone. Operations whose cost grows with the data set are
+sampled until a time budget is spent. Results are written as JSON for
+comparison across commits. Nothing needs network access.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from typing import List
+
+import bench_utils
+from bench_utils import summarize, timed
+
+BASE_PROJECT = "0x02-Session_authentication"
+DB_PROJECT = "0x03-user_authentication_service"
+
+# Stored as is, so that no hashing cost is measured while populating
+SHA256_HASH = ("5e884898da28047151d0e56f8dc62927"
+               "73603d0d6aabbdd62a11ef721d1542d8")
+BCRYPT_HASH = b"$2b$04$1dD8Rzr3BszQD6L3lBSz2.qY6cZpM9SNtHlvxLgYjB5H1JVNp1iC6"
+
+
+def email(i: int) -> str:
+    """Email of the i-th synthetic user."""
+    return "user{}@example.com".format(i)
+
+
+def bench_base(size: int, samples: int, budget: float) -> List[dict]:
+    """Benchmarks models.base with `size` users."""
+    sys.path.insert(0, bench_utils.project_path(BASE_PROJECT))
+    from models.base import DATA, INDEXES
+    from models.json_codec import BACKEND
+    from models.user import User
+
+    rnd = random.Random(42)
+    results = []
+
+    def record(operation, durations, **extra):
+        results.append(dict(layer="base", size=size, operation=operation,
+                            json_backend=BACKEND, **summarize(durations),
+                            **extra))
+
+    User.load_from_file()
+    users = DATA["User"]
+    for i in range(size):
+        user = User(email=email(i), first_name="First{}".format(i),
+                    last_name="Last{}".format(i), _password=SHA256_HASH)
+        users[user.id] = user
+
+    record("save_to_file", timed(User.save_to_file, samples, budget))
+    file_bytes = os.path.getsize(".db_User.json")
+    record("load_from_file", timed(User.load_from_file, samples, budget),
+           file_bytes=file_bytes)
+
+    ids = list(DATA["User"])
+    record("get", timed(lambda: User.get(rnd.choice(ids)), samples, budget))
+    record("search_email_hit", timed(
+        lambda: User.search({"email": email(rnd.randrange(size))}),
+        samples, budget))
+    misses = iter(range(10 ** 9))
+    record("search_email_miss", timed(
+        lambda: User.search({"email": "nobody{}@x".format(next(misses))}),
+        samples, budget))
+    record("search_email_miss_repeated", timed(
+        lambda: User.search({"email": "nobody@x"}), samples, budget))
+
+    def build_indexes():
+        INDEXES.pop("User", None)
+        User.indexes()
+    record("build_indexes", timed(build_indexes, samples, budget))
+    record("query_email", timed(
+        lambda: User.query({"email": email(rnd.randrange(size))}),
+        samples, budget))
+    record("query_sort_created_at_limit", timed(
+        lambda: User.query(sort="created_at", descending=True, limit=20),
+        samples, budget))
+    record("save", timed(lambda: User.get(rnd.choice(ids)).save(),
+                         samples, budget))
+    return results
+
+
+def bench_db(size: int, samples: int, budget: float) -> List[dict]:
+    """Benchmarks the 0x03 DB class with `size` users and sessions."""
+    sys.path.insert(0, bench_utils.project_path(DB_PROJECT))
+    from db import DB, utcnow
+    from user import UserSession
+
+    rnd = random.Random(42)
+    results = []
+
+    def record(operation, durations, **extra):
+        results.append(dict(layer="db", size=size, operation=operation,
+                            **summarize(durations), **extra))
+
+    db = DB(persistent=False, url="sqlite:///bench.db")
+    rows = ({"email": email(i), "hashed_password": BCRYPT_HASH}
+            for i in range(size))
+    elapsed = timed(lambda: db.add_users(rows, chunk_size=500), 1, budget)
+    results.append(dict(layer="db", size=size, operation="add_users_bulk",
+                        **summarize(elapsed),
+                        rows_per_sec=size * 1e9 / elapsed[0]))
+
+    # Sessions are loaded directly, as fixtures rather than a measure
+    now = utcnow()
+    session_ids = ["session-{}".format(i) for i in range(size)]
+    with db._engine.begin() as conn:
+        for start in range(0, size, 5000):
+            conn.execute(UserSession.__table__.insert(), [
+                {"id": session_ids[i], "user_id": i + 1, "created_at": now,
+                 "last_seen_at": now, "expires_at": None}
+                for i in range(start, min(size, start + 5000))])
+
+    record("find_user_by_email_hit", timed(
+        lambda: db.find_user_by(email=email(rnd.randrange(size))),
+        samples, budget))
+    record("find_user_by_email_projected", timed(
+        lambda: db.find_user_by(columns=("id", "email"),
+                                email=email(rnd.randrange(size))),
+        samples, budget))
+    misses = iter(range(10 ** 9))
+
+    def miss():
+        try:
+            db.find_user_by(email="nobody{}@x".format(next(misses)))
+        except Exception:
+            pass
+    record("find_user_by_email_miss", timed(miss, samples, budget))
+    record("find_session_user_hit", timed(
+        lambda: db.find_session_user(rnd.choice(session_ids)),
+        samples, budget))
+    record("update_user", timed(
+        lambda: db.update_user(rnd.randrange(1, size + 1),
+                               hashed_password=BCRYPT_HASH),
+        samples, budget))
+    added = iter(range(10 ** 9))
+    record("add_user", timed(
+        lambda: db.add_user("new{}@x".format(next(added)), BCRYPT_HASH),
+        samples, budget))
+
+    db.remove_session()
+    db._engine.dispose()
+    file_bytes = sum(os.path.getsize(name) for name in os.listdir(".")
+                     if name.startswith("bench.db"))
+    for result in results:
+        result["file_bytes"] = file_bytes
+    return results
+
+
+LAYERS = {"base": bench_base, "db": bench_db}
+
+
+def worker(layer: str, size: int, samples: int, budget: float) -> None:
+    """Runs one (layer, size) benchmark and prints its results."""
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        results = LAYERS[layer](size, samples, budget)
+    rss = bench_utils.peak_rss_bytes()
+    for result in results:
+        result["peak_rss_bytes"] = rss
+    json.dump(results, sys.stdout)
+
+
+def main() -> None:
+    """Runs every requested benchmark in a child process."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10000, 100000, 1000000])
+    parser.add_argument("--layers", nargs="+", choices=sorted(LAYERS),
+                        default=sorted(LAYERS))
+    parser.add_argument("--samples", type=int, default=1000,
+                        help="maximum samples per operation")
+    parser.add_argument("--budget", type=float, default=10.0,
+                        help="seconds spent at most per operation, "
+                             "after 3 samples")
+    parser.add_argument("--json-backends", nargs="+",
+                        choices=["orjson", "json"],
+                        help="JSON_BACKEND of each run of the base layer, "
+                             "instead of the default one")
+    parser.add_argument("--output", default="storage-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files and exit")
+    parser.add_argument("--worker", nargs=2, metavar=("LAYER", "SIZE"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        bench_utils.compare(*args.compare)
+        return
+    if args.worker:
+        worker(args.worker[0], int(args.worker[1]), args.samples,
+               args.budget)
+        return
+
+    results = []
+    for layer in args.layers:
+        # Only the base layer encodes JSON
+        backends = [None]
+        if layer == "base" and args.json_backends:
+            backends = args.json_backends
+        for backend, size in [(b, s) for b in backends for s in args.sizes]:
+            print("running {} with {} records...".format(layer, size),
+                  file=sys.stderr)
+            env = dict(os.environ)
+            if backend is not None:
+                env["JSON_BACKEND"] = backend
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 "--worker", layer, str(size),
+                 "--samples", str(args.samples),
+                 "--budget", str(args.budget)],
+                check=True, capture_output=True, text=True, env=env).stdout
+            results.extend(json.loads(output))
+    bench_utils.write_results(args.output, "storage", results)
+    bench_utils.print_table(results)
+
+
+if __name__ == "__main__":
+    main()